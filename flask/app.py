@@ -1,29 +1,272 @@
-from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
-from flask import Flask, request, jsonify, redirect, Response, session
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from flask import Flask, Blueprint, current_app, request, jsonify, redirect, Response, session, g
+from flask.json.provider import DefaultJSONProvider
 from bson.objectid import ObjectId
-from datetime import timedelta
+from datetime import datetime, timedelta
 from markupsafe import escape
-import json, os, sys
+import gzip, io, json, os, sys, threading, time
 
-sys.path.append('./data')
+#The modules in data/ are shared with the scripts there, which import them by name
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+if DATA_DIR not in sys.path:
+    sys.path.append(DATA_DIR)
+from database import PoolStats, create_client, supports_transactions
+from indexes import IndexBuilder
+from flight_import import parse_flight, parse_flight_date, read_records, import_flights
+from cache import LRUCache, create_cache
+from metrics import Metrics
+from sessions import ServerSideSessionInterface
+from itineraries import RouteIndex, parse_date
+from passwords import HasherBusy, create_hasher
+from seats import SEAT_FIELDS, SeatFeed
+from booking_sync import BOOKING_FLIGHT_FIELDS, Reconciler, sync_flight_bookings
+from deletions import UserDeletions
+from reports import BOOKING_COLUMNS, FORMATS, LOAD_FACTOR_GROUPS, date_filter, export, for_reports, group_rows, load_factor_pipeline
+from versions import FLIGHTS, VersionCounter
+from ratelimit import AdmissionGate, RateLimiter, create_buckets, retry_after_seconds
 
-# Connect to our local MongoDB
-mongodb_hostname = os.environ.get("MONGO_HOSTNAME","localhost")
-client = MongoClient('mongodb://'+mongodb_hostname+':27017/')
+# The database and the cache are set by connect(), when the app is created
+client = None
+db = None
+users = None
+flights = None
+bookings = None
+indexes = None
+flight_cache = None
+flight_version = None
+compressed_pages = None
+route_index = None
+#None until it is known if MongoDB runs as a replica set, see uses_transactions()
+transactions = None
+hasher = None
+limiter = None
+seat_feed = None
+reconciler = None
+deletions = None
+pool_stats = PoolStats()
+#Latency of the routes and operations on the database. Commands slower than MONGO_SLOW_QUERY_MS are logged
+metrics = Metrics(int(os.environ.get("MONGO_SLOW_QUERY_MS", 100)))
+#Refuses requests when too many are being served or MongoDB has become slow
+gate = AdmissionGate(
+    int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 256)),
+    int(os.environ.get("ADMISSION_MAX_DB_LATENCY_MS", 1000)),
+    int(os.environ.get("ADMISSION_RETRY_AFTER", 1)),
+)
 
+# All the routes of the service. They are added to the app in create_app()
+routes = Blueprint("routes", __name__)
 
-# Choose DigitalAirlines database
-db = client["DigitalAirlines"]
-users = db["Users"]
-flights = db["Flights"]
-bookings = db["Bookings"]
+#The only fields of a flight that are returned when listing flights
+FLIGHT_LIST_FIELDS = {"departAirport": 1, "destAirport": 1, "flightDate": 1}
+#Fields of the flight that a booking copies, read when its seats are taken
+BOOKED_FLIGHT_FIELDS = {field: 1 for field in BOOKING_FLIGHT_FIELDS}
+#Fields of a flight that are only used internally and never returned: the batches of user deletions that gave it seats
+HIDDEN_FLIGHT_FIELDS = {"seatReleases": 0}
+#Pages of flights smaller than this are sent without compression
+GZIP_MIN_SIZE = 1024
+#Lists are returned in pages. A page has DEFAULT_PAGE_SIZE results, unless the 'limit' argument asks for fewer or more (up to MAX_PAGE_SIZE)
+PAGE_ARGS = {"limit", "after"}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+#Requests per second and burst of every client (IP address and logged in user) on the routes that are limited.
+#RATE_LIMITS can change them, for example {"login": [1, 10]}
+RATE_LIMITS = {
+    "login": (1, 10),
+    "registration": (0.2, 5),
+    "post_new_booking": (2, 20),
+    "post_group_booking": (0.5, 5),
+}
+#Routes that are always served, so the service can be monitored while it sheds load
+UNGATED_ROUTES = {"health", "ready", "get_metrics"}
+#Routes whose commands don't count for the latency of the admission gate: the reports run long aggregations on purpose
+UNMEASURED_ROUTES = {"export_bookings", "export_load_factors"}
+#Most flights that one client can follow on the seats stream, and the seconds between keep-alive comments
+MAX_SEAT_SUBSCRIPTIONS = 20
+SEAT_HEARTBEAT = 15
+#Every open seats stream holds a thread of the worker. gunicorn.conf.py gives every worker MAX_SEAT_STREAMS threads
+#for them on top of the threads of the other routes, and more streams are refused with 503. Async mode has no limit
+MAX_SEAT_STREAMS = int(os.environ.get("MAX_SEAT_STREAMS", 50))
+seat_streams = threading.BoundedSemaphore(MAX_SEAT_STREAMS)
+#Longest date range of the fare calendar, in days
+MAX_CALENDAR_DAYS = 366
+#Most passengers of a group booking
+MAX_GROUP_SIZE = 20
+#Necessary fields of every passenger of a booking
+BOOKING_FIELDS = ["firstName", "lastName", "email", "passportNo", "birthDate", "ticketType"]
+#Documents read from MongoDB in every batch of the exports
+REPORT_BATCH_SIZE = int(os.environ.get("REPORT_BATCH_SIZE", 1000))
 
-# Initiate Flask App
-app = Flask(__name__)
-app.secret_key = "thisshouldbeabettersecret"
-#The session for both types of users expires after 5 minutes
-app.permanent_session_lifetime = timedelta(minutes=5)
+
+def connect():
+    '''
+    Connects to our MongoDB and creates the cache of the flight search results.
+    A MongoClient can't be shared between processes, so with many workers every worker connects after it starts.
+    Nothing here waits for MongoDB: the client connects on the first request and the indexes are created in the background
+    '''
+    global client, db, users, flights, bookings, indexes, flight_cache, flight_version, compressed_pages, route_index, transactions, hasher, limiter, seat_feed, reconciler, deletions
+    #The pool size, timeouts, read preference and write concern are set from the environment (see data/database.py)
+    client = create_client([pool_stats, metrics, gate])
+    transactions = None
+
+    # Choose DigitalAirlines database
+    db = client["DigitalAirlines"]
+    users = db["Users"]
+    flights = db["Flights"]
+    bookings = db["Bookings"]
+    indexes = IndexBuilder(db)
+    indexes.start()
+
+    #Cache of the flight search results, by version of the flights. The version goes up (and the cache is cleared)
+    #every time a flight is created, updated or deleted, and other workers see it after FLIGHT_VERSION_TTL seconds
+    flight_cache = create_cache(
+        os.environ.get("FLIGHT_CACHE_URL"),
+        int(os.environ.get("FLIGHT_CACHE_SIZE", 1024)),
+        int(os.environ.get("FLIGHT_CACHE_TTL", 60)),
+    )
+    flight_version = VersionCounter(db["Versions"], FLIGHTS, float(os.environ.get("FLIGHT_VERSION_TTL", 1)))
+    #The same pages compressed with gzip, for the clients that accept it. They are kept in the process
+    compressed_pages = LRUCache(int(os.environ.get("FLIGHT_CACHE_SIZE", 1024)), int(os.environ.get("FLIGHT_CACHE_TTL", 60)))
+
+    #Token buckets of the rate limits, in the process or in the Redis of RATE_LIMIT_STORE_URL
+    #A route given null in RATE_LIMITS is not limited
+    limits = dict(RATE_LIMITS)
+    limits.update(json.loads(os.environ.get("RATE_LIMITS", "{}")))
+    limits = {route: limit for route, limit in limits.items() if limit}
+    limiter = RateLimiter(create_buckets(os.environ.get("RATE_LIMIT_STORE_URL")), limits)
+
+    #Hashes the passwords in a pool of PASSWORD_HASH_WORKERS threads with the scrypt cost of PASSWORD_HASH_COST
+    hasher = create_hasher()
+
+    #The network of flights used to find connections. It is loaded on the first search
+    route_index = RouteIndex(
+        int(os.environ.get("MIN_CONNECTION_DAYS", 0)),
+        int(os.environ.get("MAX_CONNECTION_DAYS", 1)),
+        int(os.environ.get("ROUTE_INDEX_TTL", 60)),
+    )
+
+    #Sends the seat changes to the subscribed clients. It needs a replica set for change streams, otherwise it polls
+    seat_feed = SeatFeed(flights, uses_transactions, float(os.environ.get("SEAT_POLL_INTERVAL", 1)))
+
+    #Repairs every BOOKING_RECONCILE_INTERVAL seconds the bookings whose copy of their flight is out of date (0 turns it off)
+    interval = float(os.environ.get("BOOKING_RECONCILE_INTERVAL", 3600))
+    reconciler = None
+    if interval > 0:
+        reconciler = Reconciler(flights, bookings, interval, int(os.environ.get("BOOKING_RECONCILE_BATCH_SIZE", 500)))
+        reconciler.start()
+
+    #Deletes the users that asked for it with their bookings, in batches of USER_DELETION_BATCH_SIZE bookings
+    deletions = UserDeletions(
+        users, bookings, flights, db["UserDeletions"],
+        int(os.environ.get("USER_DELETION_BATCH_SIZE", 500)),
+        int(os.environ.get("USER_DELETION_LEASE", 60)),
+        float(os.environ.get("USER_DELETION_POLL_INTERVAL", 30)),
+    )
+    deletions.start()
+
+
+def json_default(value):
+    '''
+    Converts the values that json can't write. Ids are written as strings and flight dates as year-month-day
+    '''
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    return DefaultJSONProvider.default(value)
+
+
+class JSONProvider(DefaultJSONProvider):
+    default = staticmethod(json_default)
+
+
+def uses_transactions():
+    '''
+    Tells if MongoDB runs as a replica set (or a sharded cluster), so group bookings are written in a transaction
+    and the seats are followed with a change stream. It is asked on first use and remembered
+    '''
+    global transactions
+    if transactions == None:
+        transactions = supports_transactions(client)
+    return bool(transactions)
+
+
+def create_app():
+    '''
+    Creates the Flask app. Importing this module has no side effects, everything is set up here
+    '''
+    connect()
+    app = Flask(__name__)
+    app.json = JSONProvider(app)
+    app.secret_key = "thisshouldbeabettersecret"
+    #The session for both types of users expires after 5 minutes
+    app.permanent_session_lifetime = timedelta(minutes=5)
+    #The sessions are kept on the server, in the process or in the Redis of SESSION_STORE_URL, and expire with the same lifetime
+    app.session_interface = ServerSideSessionInterface(create_cache(
+        os.environ.get("SESSION_STORE_URL"),
+        int(os.environ.get("SESSION_STORE_SIZE", 100000)),
+        int(app.permanent_session_lifetime.total_seconds()),
+        "sessions",
+    ))
+    app.register_blueprint(routes)
+    app.before_request(start_timer)
+    app.before_request(admit)
+    app.after_request(record_latency)
+    app.teardown_request(release)
+    return app
+
+
+def start_timer():
+    '''
+    Runs before every request and starts counting its time and its operations on the database
+    '''
+    g.start = time.perf_counter()
+    metrics.start_request()
+
+
+def record_latency(response):
+    '''
+    Runs after every request and records its latency for the route. A streamed body (like the pages of bookings or
+    the reports) runs its queries while it is sent, after this, so it is recorded when the server closes the response.
+    The server sends the body from the same thread, so its operations on the database are counted for the request
+    '''
+    route = request.url_rule.rule if request.url_rule != None else "unmatched"
+    method = request.method
+    start = g.start
+
+    def record():
+        metrics.end_request(route, method, response.status_code, time.perf_counter() - start)
+
+    if response.is_streamed:
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+
+def admit():
+    '''
+    Runs before every request. Refuses it with 429 if the client is over the rate limit of the route,
+    or with 503 if the admission gate sheds load. Both answers say when to try again in Retry-After
+    '''
+    route = request.endpoint.split(".")[-1] if request.endpoint != None else None
+    if route in UNGATED_ROUTES:
+        return None
+    wait = limiter.check(route, request.remote_addr, session.get("username"))
+    if wait > 0:
+        return Response("Too many requests, please try again later", status=429, mimetype="application/json",
+                        headers={"Retry-After": retry_after_seconds(wait)})
+    refused = gate.enter(route not in UNMEASURED_ROUTES)
+    if refused != None:
+        return Response(refused, status=503, mimetype="application/json", headers={"Retry-After": str(gate.retry_after)})
+    g.admitted = True
+
+
+def release(error=None):
+    '''
+    Runs after every request, even if it failed, and lets the gate admit another one
+    '''
+    if g.pop("admitted", False):
+        gate.leave()
 
 
 def is_logged_in():
@@ -35,30 +278,479 @@ def is_logged_in():
 
 def is_user():
     '''
-    Checks if the current user is a simple user
+    Checks if the current user is a simple user. The type is stored in the session at login
     '''
-    user = users.find({"type": "User"})
-    for u in user:
-        if session["username"] == u["username"]:
-            return True
-    return False
+    return session.get("type") == "User"
 
 
 def is_admin():
     '''
     Checks if the current user is an admin
     '''
-    return session["username"] == "admin1" or session["username"] == "admin2"
+    return session.get("type") == "Admin"
+
+
+def login_query(data):
+    '''
+    Returns the query of the user that logs in with the email of data. Users that are being deleted can't log in
+    '''
+    return {"email": escape(data["email"]), "status": {"$ne": "deleting"}}
+
+
+def start_user_session(session, user):
+    '''
+    Starts a new session for the user that logged in, with everything the routes need to know about them
+    '''
+    session.clear()
+    session.regenerate()
+    session["username"] = user["username"]
+    session["userId"] = str(user["_id"])
+    session["email"] = user["email"]
+    session["type"] = user["type"]
+    session.permanent = True
+
+
+def reserve_seat(flight_id, ticket_type):
+    '''
+    Takes one seat of the given ticket type from a flight, only if there is one left.
+    The check and the decrement happen in a single atomic update, so concurrent bookings can't oversell.
+    Returns the route of the flight, or None if there are no seats left of that type
+    '''
+    return reserve_seats(flight_id, {ticket_type: 1})
+
+
+def seat_reservation(flight_id, seats):
+    '''
+    Returns the query and the update that take the given number of seats of every ticket type
+    (for example {"economy": 3, "business": 1}) from a flight, only if there are enough left of all of them
+    '''
+    query = {"_id": flight_id}
+    update = {}
+    for ticket_type, count in seats.items():
+        query[ticket_type + "AvailableTickets"] = {"$gte": count}
+        update[ticket_type + "AvailableTickets"] = -count
+    return query, {"$inc": update}
+
+
+def seat_release(seats):
+    '''
+    Returns the update that gives back the given number of seats of every ticket type to a flight
+    '''
+    return {"$inc": {ticket_type + "AvailableTickets": count for ticket_type, count in seats.items()}}
+
+
+def reserve_seats(flight_id, seats, db_session=None):
+    '''
+    Takes the seats from a flight in a single atomic update, see seat_reservation().
+    Returns the route of the flight, or None if there aren't enough seats
+    '''
+    query, update = seat_reservation(flight_id, seats)
+    return flights.find_one_and_update(query, update, projection=BOOKED_FLIGHT_FIELDS, session=db_session)
+
+
+def release_seat(flight_id, ticket_type):
+    '''
+    Gives back one seat of the given ticket type to a flight
+    '''
+    release_seats(flight_id, {ticket_type: 1})
+
+
+def release_seats(flight_id, seats):
+    '''
+    Gives back the given number of seats of every ticket type to a flight
+    '''
+    flights.update_one({"_id": flight_id}, seat_release(seats))
+
+
+def flight_search_query(args):
+    '''
+    Returns the query of a flight search from its arguments: departAirport and destAirport together,
+    flightDate, or all three. Raises a ValueError with the message for the user if they are not valid
+    '''
+    #Check if the user provided filters
+    if not set(args) - PAGE_ARGS:
+        return {}
+    depAirport = args.get("departAirport")
+    destAirport = args.get("destAirport")
+    flightDate = args.get("flightDate")
+    if flightDate is not None:
+        flightDate = parse_flight_date(flightDate)
+
+    #All three filters were provided
+    if (depAirport is not None and destAirport is not None and flightDate is not None):
+        return {"departAirport": depAirport, "destAirport": destAirport, "flightDate": flightDate}
+    #Only departure airport and destination airport were provided
+    elif (depAirport is not None and destAirport is not None and flightDate is None):
+        return {"departAirport": depAirport, "destAirport": destAirport}
+    #Only flight date was provided
+    elif depAirport is None and destAirport is None and flightDate is not None:
+        return {"flightDate": flightDate}
+    raise ValueError("The query parameter is not valid")
+
+
+def fare_calendar_pipeline(args):
+    '''
+    Returns the aggregation of the fare calendar of a route (departAirport, destAirport) between the dates from and to.
+    Raises a ValueError with the message for the user if the arguments are not valid
+    '''
+    depAirport = args.get("departAirport")
+    destAirport = args.get("destAirport")
+    if depAirport is None or destAirport is None or args.get("from") is None or args.get("to") is None:
+        raise ValueError("departAirport, destAirport, from and to are required")
+    start = parse_flight_date(args.get("from"))
+    end = parse_flight_date(args.get("to"))
+    if end < start or (end - start).days >= MAX_CALENDAR_DAYS:
+        raise ValueError("The date range must be up to " + str(MAX_CALENDAR_DAYS) + " days")
+
+    def fare(ticket_type):
+        #$min skips nulls, so flights without seats left are not counted
+        return {"$min": {"$cond": [{"$gt": ["$" + ticket_type + "AvailableTickets", 0]}, "$" + ticket_type + "TicketCost", None]}}
+
+    return [
+        {"$match": {"departAirport": depAirport, "destAirport": destAirport, "flightDate": {"$gte": start, "$lte": end}}},
+        {"$group": {
+            "_id": "$flightDate",
+            "flights": {"$sum": 1},
+            "economyMinFare": fare("economy"),
+            "businessMinFare": fare("business"),
+            "economyAvailableTickets": {"$sum": "$economyAvailableTickets"},
+            "businessAvailableTickets": {"$sum": "$businessAvailableTickets"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def group_seats(data):
+    '''
+    Reads the passengers of a group booking and counts the seats of every ticket type that the group needs.
+    Raises a ValueError with the message for the user if they are not valid
+    '''
+    passengers = data.get("passengers") if isinstance(data, dict) else None
+    if not isinstance(passengers, list) or len(passengers) == 0:
+        raise ValueError("A list of passengers is required")
+    if len(passengers) > MAX_GROUP_SIZE:
+        raise ValueError("A group booking can have up to " + str(MAX_GROUP_SIZE) + " passengers")
+    seats = {}
+    for passenger in passengers:
+        if not isinstance(passenger, dict) or any(not field in passenger for field in BOOKING_FIELDS):
+            raise ValueError("Information incompleted")
+        if (passenger["ticketType"] != "economy" and passenger["ticketType"] != "business"):
+            raise ValueError("Ticket Type must business or economy")
+        seats[passenger["ticketType"]] = seats.get(passenger["ticketType"], 0) + 1
+    return passengers, seats
+
+
+def seat_event(name, data):
+    '''
+    Returns an event of the Server-Sent Events stream
+    '''
+    return "event: " + name + "\ndata: " + json.dumps(data, default=json_default, sort_keys=True) + "\n\n"
+
+
+def seat_events(changes):
+    '''
+    Turns the changes of a subscriber of the seat feed into events: 'seats' with the seats that changed, or 'deleted'
+    '''
+    for flight_id, seats in changes.items():
+        if seats == None:
+            yield seat_event("deleted", {"_id": flight_id})
+        else:
+            yield seat_event("seats", dict(seats, _id=flight_id))
+
+
+def parse_seat_subscription(args):
+    '''
+    Reads the ids of the flights to follow from the 'ids' argument, separated by commas.
+    Raises a ValueError with the message for the user if they are not valid
+    '''
+    ids = [id for id in args.get("ids", "").split(",") if id]
+    if len(ids) == 0 or len(ids) > MAX_SEAT_SUBSCRIPTIONS:
+        raise ValueError("Give from 1 to " + str(MAX_SEAT_SUBSCRIPTIONS) + " flight ids in 'ids', separated by commas")
+    try:
+        return [ObjectId(id) for id in ids]
+    except Exception:
+        raise ValueError("The flight ids are not valid")
+
+
+def booking_error(data):
+    '''
+    Returns why the data of a booking is not valid, or None if it is
+    '''
+    #Necessary fields to create a booking
+    if any(not field in data for field in BOOKING_FIELDS):
+        return "Information incompleted"
+    #Ticket type must be only 'economy' or 'business'
+    if (data["ticketType"] != "economy" and data["ticketType"] != "business"):
+        return "Ticket Type must business or economy"
+    return None
+
+
+def written_bookings(group):
+    '''
+    Returns the ids of the bookings of a group that may have been written. insert_many gives every booking its id before sending it
+    '''
+    return {"_id": {"$in": [booking["_id"] for booking in group if "_id" in booking]}}
+
+
+def make_booking(data, flight, flight_id):
+    '''
+    Returns the booking of a passenger on a flight, with the route of the flight copied in it
+    '''
+    #We add the flightID to demonstrate the One-to-Many relationship with the 'flights' collection
+    return {
+        "firstName": escape(data["firstName"]),
+        "lastName": escape(data["lastName"]),
+        "passportNo": escape(data["passportNo"]),
+        "birthDate": escape(data["birthDate"]),
+        "email": escape(data["email"]),
+        "ticketType": escape(data["ticketType"]),
+        "departAirport": flight["departAirport"],
+        "destAirport": flight["destAirport"],
+        "flightDate": flight["flightDate"],
+        "flightID": flight_id,
+    }
+
+
+def book_group(flight_id, passengers, seats, db_session=None):
+    '''
+    Takes the seats of a group from a flight in one update and writes the bookings of all the passengers in one insert.
+    In a transaction (db_session) MongoDB undoes both if anything fails. Without one, the bookings
+    that were written are deleted and the seats are given back.
+    Returns the bookings, or None if there aren't enough seats for the whole group
+    '''
+    flight = reserve_seats(flight_id, seats, db_session)
+    if flight == None:
+        return None
+    group = [make_booking(passenger, flight, flight_id) for passenger in passengers]
+    try:
+        bookings.insert_many(group, session=db_session)
+    except Exception:
+        if db_session == None:
+            bookings.delete_many(written_bookings(group))
+            release_seats(flight_id, seats)
+        raise
+    return group
+
+
+def get_page_args(args):
+    '''
+    Reads the 'limit' and 'after' arguments of a list request.
+    'after' is the id of the last result of the previous page. Raises an exception if they are not valid
+    '''
+    limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    after = args.get("after")
+    if after is not None:
+        after = ObjectId(after)
+    return min(limit, MAX_PAGE_SIZE), after
+
+
+def find_page(collection, query, projection, limit, after):
+    '''
+    Returns a cursor over one page of the results of a query, ordered by id.
+    The page starts right after the given id, so no results are skipped on the server
+    '''
+    if after is not None:
+        query = dict(query, _id={"$gt": after})
+    return collection.find(query, projection).sort("_id", 1).limit(limit)
+
+
+def stream_json_page(iterable, name, limit):
+    '''
+    Writes a page of documents as json, one document at a time, so the whole page never has to be kept in memory.
+    The documents are listed under 'name' and 'next' has the value of 'after' for the next page, or null if this is the last one
+    '''
+    yield '{"' + name + '":['
+    count = 0
+    last = None
+    for document in iterable:
+        if count > 0:
+            yield ","
+        yield json.dumps(document, default=json_default, sort_keys=True, separators=(",", ":"))
+        count += 1
+        last = document["_id"]
+    next = str(last) if count == limit else None
+    yield '],"next":' + json.dumps(next) + "}"
+
+
+def flights_changed():
+    '''
+    Runs after every change of the flights. Their version goes up, so the cached pages and their ETags are not used anymore
+    '''
+    flight_version.bump()
+    flight_cache.clear()
+    compressed_pages.clear()
+
+
+def flight_page_etag(version, compressed):
+    '''
+    The ETag of a page of flights is the version of the flights, so it changes with any flight.
+    The compressed and the plain page have different ETags
+    '''
+    return "flights-" + str(version) + ("-gzip" if compressed else "")
+
+
+def flight_page_headers(version, compressed):
+    return {"ETag": '"' + flight_page_etag(version, compressed) + '"', "Vary": "Accept-Encoding", "Cache-Control": "private, no-cache"}
+
+
+def flight_page_cached(if_none_match, version):
+    '''
+    Tells if the client already has a page of this version of the flights: None if it doesn't,
+    otherwise if the page it has is compressed
+    '''
+    for compressed in (False, True):
+        if if_none_match.contains(flight_page_etag(version, compressed)):
+            return compressed
+    return None
+
+
+def flight_page_body(key, page, accept_encodings):
+    '''
+    Returns the page to send and if it is compressed. Each page is compressed once and then sent
+    from compressed_pages to all the clients that accept gzip
+    '''
+    if len(page) < GZIP_MIN_SIZE or not accept_encodings["gzip"]:
+        return page, False
+    body = compressed_pages.get(key)
+    if body == None:
+        body = gzip.compress(page.encode(), compresslevel=6)
+        compressed_pages.set(key, body)
+    return body, True
+
+def flight_manifest_pipeline(flight_id, limit=None, after=None):
+    '''
+    Returns the aggregation of the manifest of a flight: its details, its passengers ordered by booking id
+    (a page of them if limit is given) and the seats sold and revenue of every class.
+    The bookings are joined with two pipelines that run on the index of the bookings of a flight: one reads only
+    the page of passengers and the other counts the seats of every class, so no more than a page of bookings is loaded.
+    The revenue is computed in the database with the current ticket costs of the flight
+    '''
+    #Passengers are ordered by booking id and those up to 'after' are skipped
+    passengers = [{"$match": {"_id": {"$gt": after}}}] if after is not None else []
+    passengers.append({"$sort": {"_id": 1}})
+    if limit is not None:
+        passengers.append({"$limit": limit})
+    passengers.append({"$project": {"_id": 1, "name": "$firstName", "lastName": 1, "ticketType": 1}})
+
+    def sold(ticket_type):
+        return {"$sum": {"$map": {
+            "input": {"$filter": {"input": "$sold", "as": "s", "cond": {"$eq": ["$$s._id", ticket_type]}}},
+            "as": "s",
+            "in": "$$s.count",
+        }}}
+
+    return [
+        {"$match": {"_id": flight_id}},
+        {"$lookup": {"from": "Bookings", "localField": "_id", "foreignField": "flightID", "pipeline": passengers, "as": "passengers"}},
+        {"$lookup": {
+            "from": "Bookings",
+            "localField": "_id",
+            "foreignField": "flightID",
+            "pipeline": [{"$group": {"_id": "$ticketType", "count": {"$sum": 1}}}],
+            "as": "sold",
+        }},
+        {"$addFields": {"economySold": sold("economy"), "businessSold": sold("business")}},
+        {"$project": {
+            "_id": 0,
+            "flight": {
+                "_id": {"$toString": "$_id"},
+                "businessAvailableTickets": "$businessAvailableTickets",
+                "businessTicketCost": "$businessTicketCost",
+                "departAirport": "$departAirport",
+                "destAirport": "$destAirport",
+                "economyAvailableTickets": "$economyAvailableTickets",
+                "economyTicketCost": "$economyTicketCost",
+                "flightDate": "$flightDate",
+            },
+            "classes": {
+                "economy": {"sold": "$economySold", "revenue": {"$multiply": ["$economySold", "$economyTicketCost"]}},
+                "business": {"sold": "$businessSold", "revenue": {"$multiply": ["$businessSold", "$businessTicketCost"]}},
+            },
+            "passengers": 1,
+        }},
+    ]
+
+
+def flight_manifest(flight_id, limit=None, after=None):
+    '''
+    Returns the manifest of a flight, see flight_manifest_pipeline(). Returns None if there is no such flight
+    '''
+    for manifest in flights.aggregate(flight_manifest_pipeline(flight_id, limit, after)):
+        return manifest
+    return None
+
+
+def manifest_page(manifest, limit):
+    '''
+    Returns the manifest as a page of the manifest route, with the id to ask for the next page
+    '''
+    passengers = manifest["passengers"]
+    manifest["next"] = str(passengers[-1]["_id"]) if len(passengers) == limit else None
+    for traveller in passengers:
+        traveller["_id"] = str(traveller["_id"])
+    return manifest
+
+
+def manifest_details(manifest):
+    '''
+    Returns the manifest as the admins get it from the flight route: the flight and then its passengers
+    '''
+    output = [manifest["flight"], "Bookings"]
+    for traveller in manifest["passengers"]:
+        del traveller["_id"]
+        output.append(traveller)
+    return output
 
 #Home Route
-@app.route("/", methods=["GET"])
+@routes.route("/", methods=["GET"])
 def home():
     return "<h1>Welcome to Digital Airlines</h1> <h3>Click <a href='/login'>HERE</a> to login</h3>"
 
+#Health route. Checks if the database answers and reports the connections of the pool. Returns 503 if the database is down
+@routes.route("/health", methods=["GET"])
+def health():
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        return Response(json.dumps({"status": "unavailable", "error": str(e), "pool": pool_stats.report()}), status=503, mimetype="application/json")
+    return jsonify({"status": "ok", "pool": pool_stats.report()})
+
+#Readiness route. The service is ready as soon as it starts, without waiting for MongoDB: the requests that need it wait for it.
+#It reports if the pool has connected to MongoDB yet and if the indexes are built, /health checks that MongoDB answers.
+#Returns 503 if MongoDB refused to create an index, since registration can't work without the unique ones
+@routes.route("/ready", methods=["GET"])
+def ready():
+    report = {
+        "status": "ready",
+        "database": "connected" if pool_stats.report()["open"] > 0 else "connecting",
+        "indexes": indexes.state(),
+    }
+    if indexes.error != None:
+        report.update({"status": "unavailable", "error": indexes.error})
+        return Response(json.dumps(report), status=503, mimetype="application/json")
+    return jsonify(report)
+
+#Metrics route. Returns the latency of the routes, the operations on the database and the connections of the pool in the Prometheus text format
+@routes.route("/metrics", methods=["GET"])
+def get_metrics():
+    pool = pool_stats.report()
+    lines = [metrics.render()]
+    lines.append("# TYPE mongo_pool_connections gauge")
+    lines.append('mongo_pool_connections{state="open"} %d' % pool["open"])
+    lines.append('mongo_pool_connections{state="checkedOut"} %d' % pool["checkedOut"])
+    lines.append("# TYPE mongo_pool_checkout_failures_total counter")
+    lines.append("mongo_pool_checkout_failures_total %d" % pool["checkoutFailures"])
+    return Response("\n".join(lines) + "\n", status=200, mimetype="text/plain")
+
 #Registration route. Method GET returns the form and method POST creates a user
-@app.route("/register", methods=["GET", "POST"])
+@routes.route("/register", methods=["GET", "POST"])
 def registration():
     if request.method == "POST":
+        #The unique indexes are the only check for users that already exist, so nobody can register before they are built
+        if not indexes.built.is_set():
+            return Response("Registration is not available yet, please try again later", status=503, mimetype="application/json", headers={"Retry-After": "5"})
         data = None
         form = request.form
         try:
@@ -86,24 +778,29 @@ def registration():
                 "Information incomplete", status=500, mimetype="application/json"
             )
 
-        # Check if there is a user with the same email or username
-        if (users.count_documents({"$or": [{"email": data["email"]}, {"username": data["username"]}]}) == 0):
-            #Create user with the 'escaped' data
-            user = {
-                "email": escape(data["email"]),
-                "password": escape(data["password"]),
-                "username": escape(data["username"]),
-                "fullName": escape(data["fullName"]),
-                "birthDate": escape(data["birthDate"]),
-                "country": escape(data["country"]),
-                "passportNo": escape(data["passportNo"]),
-                "type": "User",
-            }
-            # Add user to the 'users' collection
+        #Only the hash of the password is stored
+        try:
+            password = hasher.hash(str(data["password"])).result()
+        except HasherBusy:
+            return Response("Too many registrations at the moment, please try again later", status=503, mimetype="application/json")
+
+        #Create user with the 'escaped' data
+        user = {
+            "email": escape(data["email"]),
+            "password": password,
+            "username": escape(data["username"]),
+            "fullName": escape(data["fullName"]),
+            "birthDate": escape(data["birthDate"]),
+            "country": escape(data["country"]),
+            "passportNo": escape(data["passportNo"]),
+            "type": "User",
+        }
+        # Add user to the 'users' collection. The unique indexes on email and username reject duplicates
+        try:
             users.insert_one(user)
-            return Response(data["email"] + " was added to the system", status=200, mimetype="application/json")
-        else:
+        except DuplicateKeyError:
             return Response("A user with the given email or username already exists", status=400, mimetype="application/json")
+        return Response(data["email"] + " was added to the system", status=200, mimetype="application/json")
     else:
         #HTML FORM 
         return ''' 
@@ -121,7 +818,7 @@ def registration():
         '''
 
 #Login route. Method GET returns the form and method POST creates a session for the user
-@app.route("/login", methods=["GET", "POST"])
+@routes.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         form = request.form
@@ -141,15 +838,18 @@ def login():
         if not "email" in data or not "password" in data:
             return Response("Information incomplete", status=400, mimetype="application/json")
         
-        user = users.find_one(
-            {"$and": [{"email": escape(data["email"])}, {"password": escape(data["password"])}]}
-        )
+        user = users.find_one(login_query(data))
+        #The password is checked in the pool of the hasher. Passwords stored in plain text or with an older cost are hashed again
+        try:
+            valid, new_hash = hasher.check(str(data["password"]), user.get("password")).result() if user != None else (False, None)
+        except HasherBusy:
+            return Response("Too many logins at the moment, please try again later", status=503, mimetype="application/json")
         #If user exists create a cookie with their username
-        if user != None: 
-            if is_logged_in():
-                session.pop("username", None)
-            session["username"] = user["username"]
-            session.permanent = True
+        if valid:
+            if new_hash != None:
+                #Only if the password wasn't changed in the meantime
+                users.update_one({"_id": user["_id"], "password": user["password"]}, {"$set": {"password": new_hash}})
+            start_user_session(session, user)
             return Response("Welcome", status=200, mimetype="application/json")
         return Response("Invalid credentials. Please try again!", status=401, mimetype="application/json")
     else:
@@ -164,133 +864,186 @@ def login():
         '''
 
 #Logout route. Deletes the active session for the user
-@app.route("/logout", methods=["GET"])
+@routes.route("/logout", methods=["GET"])
 def logout():
     if "username" in session:
-        session.pop("username", None)
+        session.clear()
         return Response("You logged out successfully!", status=200, mimetype="application/json")
     else:
         return Response("You are already logged out!", status=200, mimetype="application/json")
 
 
 #Flights route. Available for both simple user and admin
-@app.route("/flights", methods=["GET"])
+@routes.route("/flights", methods=["GET"])
 def get_flights():
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
     else:
-        #Check if the user provided arguments
         args = request.args
-        if args:
-            depAirport = args.get("departAirport")
-            destAirport = args.get("destAirport")
-            flightDate = args.get("flightDate")
-
-            #All three filters were provided
-            if (depAirport is not None and destAirport is not None and flightDate is not None):
-                iterable = flights.find({
-                    "$and": [
-                        {"departAirport": depAirport},
-                        {"destAirport": destAirport},
-                        {"flightDate": flightDate}
-                    ]
-                })
-                output = []
-                
-                #Print the id of the flight, the departure airport, the destination airport and the date of the flight
-                for flight in iterable:
-                    f = {
-                        "_id": str(flight["_id"]),
-                        "departAirport": flight["departAirport"],
-                        "destAirport": flight["destAirport"],
-                        "flightDate": flight["flightDate"],
-                    }
-                    output.append(f)
-                return jsonify(output)
-            
-            #Only departure airport and destination airport were provided
-            elif (depAirport is not None and destAirport is not None and flightDate is None):
-                iterable = flights.find({
-                    "$and": [
-                        {"departAirport": depAirport},
-                        {"destAirport": destAirport},
-                    ]
-                })
-                output = []
-
-                #Print the id of the flight, the departure airport, the destination airport and the date of the flight
-                for flight in iterable:
-                    f = {
-                        "_id": str(flight["_id"]),
-                        "departAirport": flight["departAirport"],
-                        "destAirport": flight["destAirport"],
-                        "flightDate": flight["flightDate"],
-                    }
-                    output.append(f)
-                return jsonify(output)
-            
-            #Only flight date was provided
-            elif depAirport is None and destAirport is None and flightDate is not None:
-                iterable = flights.find({"flightDate": flightDate})
-                output = []
-
-                #Print the id of the flight, the departure airport, the destination airport and the date of the flight
-                for flight in iterable:
-                    f = {
-                        "_id": str(flight["_id"]),
-                        "departAirport": flight["departAirport"],
-                        "destAirport": flight["destAirport"],
-                        "flightDate": flight["flightDate"],
-                    }
-                    output.append(f)
-                return jsonify(output)
+        try:
+            limit, after = get_page_args(args)
+        except Exception as e:
+            return Response("The page arguments are not valid", status=400, mimetype="application/json")
+
+        try:
+            query = flight_search_query(args)
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype="application/json")
+
+        #A client that already has this page gets 304 Not Modified until a flight changes, without reading MongoDB
+        version = flight_version.get()
+        cached = flight_page_cached(request.if_none_match, version)
+        if cached != None:
+            return Response(status=304, headers=flight_page_headers(version, cached))
+
+        #Print the id of the flight, the departure airport, the destination airport and the date of the flight.
+        #The same search is answered from the cache until a flight changes
+        key = (version, tuple(sorted(query.items())), limit, str(after))
+        page = flight_cache.get(key)
+        if page == None:
+            iterable = find_page(flights, query, FLIGHT_LIST_FIELDS, limit, after)
+            page = "".join(stream_json_page(iterable, "flights", limit))
+            flight_cache.set(key, page)
+        body, compressed = flight_page_body(key, page, request.accept_encodings)
+        headers = flight_page_headers(version, compressed)
+        if compressed:
+            headers["Content-Encoding"] = "gzip"
+        return Response(body, status=200, mimetype="application/json", headers=headers)
+
+
+#Fare calendar route. Available for both simple user and admin. For every day of a date range it returns
+#the lowest fares of the flights of a route that still have seats, and the seats left
+@routes.route("/flights/calendar", methods=["GET"])
+def get_fare_calendar():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+
+    args = request.args
+    try:
+        pipeline = fare_calendar_pipeline(args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+    output = []
+    for day in flights.aggregate(pipeline):
+        day["flightDate"] = day.pop("_id")
+        output.append(day)
+    return jsonify({"departAirport": args.get("departAirport"), "destAirport": args.get("destAirport"), "days": output})
+
+#Seats stream route. Available for both simple user and admin. Instead of polling /flights/<id>, a client follows
+#the available tickets of some flights (/flights/seats?ids=<id>,<id>) as Server-Sent Events
+@routes.route("/flights/seats", methods=["GET"])
+def get_seat_stream():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    try:
+        flight_ids = parse_seat_subscription(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+
+    if not seat_streams.acquire(blocking=False):
+        return Response("Too many seat streams are open, please try again later", status=503, mimetype="application/json",
+                        headers={"Retry-After": str(SEAT_HEARTBEAT)})
+
+    #Subscribe before reading the seats, so no change is lost in between
+    wake = threading.Event()
+    subscriber = seat_feed.subscribe([str(id) for id in flight_ids], wake.set)
+
+    def close():
+        #The client went away. It runs even if the stream never started
+        seat_feed.unsubscribe(subscriber)
+        seat_streams.release()
+
+    try:
+        snapshot = {str(flight.pop("_id")): flight for flight in flights.find({"_id": {"$in": flight_ids}}, SEAT_FIELDS)}
+    except Exception:
+        close()
+        raise
+
+    def stream():
+        yield from seat_events(snapshot)
+        while True:
+            wake.wait(SEAT_HEARTBEAT)
+            wake.clear()
+            changes = subscriber.take()
+            if changes:
+                yield from seat_events(changes)
             else:
-                return Response("The query parameter is not valid", status=400, mimetype="application/json")
-        else:
-            iterable = flights.find({})
-            output = []
-            for flight in iterable:
-                f = {
-                    "_id": str(flight["_id"]),
-                    "departAirport": flight["departAirport"],
-                    "destAirport": flight["destAirport"],
-                    "flightDate": flight["flightDate"],
-                }
-                output.append(f)
-            return jsonify(output)
+                yield ": keep-alive\n\n"
+
+    response = Response(stream(), status=200, mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(close)
+    return response
+
+#Itineraries route. Available for both simple user and admin. Finds the flights from an airport to another on a date,
+#direct or with up to two connections, cheapest first
+@routes.route("/itineraries", methods=["GET"])
+def get_itineraries():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
 
+    args = request.args
+    depAirport = args.get("departAirport")
+    destAirport = args.get("destAirport")
+    flightDate = parse_date(args.get("flightDate"))
+    if depAirport is None or destAirport is None or flightDate is None:
+        return Response("departAirport, destAirport and flightDate (year-month-day) are required", status=400, mimetype="application/json")
+    ticketType = args.get("ticketType", "economy")
+    if (ticketType != "economy" and ticketType != "business"):
+        return Response("Ticket Type must business or economy", status=400, mimetype="application/json")
+    try:
+        maxStops = min(int(args.get("maxStops", 2)), 2)
+        limit = min(int(args.get("limit", 20)), MAX_PAGE_SIZE)
+    except Exception as e:
+        return Response("maxStops and limit must be numbers", status=400, mimetype="application/json")
+
+    route_index.ensure_loaded(flights)
+    itineraries = route_index.search(escape(depAirport), escape(destAirport), flightDate, maxStops, ticketType, limit)
+    return jsonify({"itineraries": itineraries})
 
 #Specific flight route. Prints information about a specific flight depending on the user type
-@app.route("/flights/<id>", methods=["GET"])
+@routes.route("/flights/<id>", methods=["GET"])
 def get_flights_byId(id):
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
     if id == None:
         return Response("Bad request", status=400, mimetype="application/json")
-    
-    #Find flight based on the given id
-    flight = flights.find_one({"_id": ObjectId(id)})
-    output = []
-    if flight != None:
-        if is_user():
-            #Prints all the details of the flight
+
+    if is_admin():
+        #Prints the details of the flight and the name, last name and ticket type of every booking in this flight
+        manifest = flight_manifest(ObjectId(id))
+        if manifest != None:
+            return jsonify(manifest_details(manifest))
+    elif is_user():
+        #Find flight based on the given id and print all the details of the flight
+        flight = flights.find_one({"_id": ObjectId(id)}, HIDDEN_FLIGHT_FIELDS)
+        if flight != None:
             flight["_id"] = str(flight["_id"])
             return jsonify(flight)
-        elif is_admin():
-            #Prints the details of the flight and the name, last name and ticket type of every booking in this flight
-            flight["_id"] = str(flight["_id"])
-            output.append(flight)
-            booking = bookings.find({"flightID": ObjectId(id)})
-            output.append("Bookings")
-            for b in booking:
-                traveller = {"name": b["firstName"], "lastName": b["lastName"], "ticketType": b["ticketType"]}
-                output.append(traveller)
-            return jsonify(output)
     return Response("No flight found", status=500, mimetype="application/json")
 
 
+#Flight manifest route. Only available for admins. Returns the passengers of a flight in pages,
+#with the seats sold and the revenue of every class
+@routes.route("/flights/<id>/manifest", methods=["GET"])
+def get_flight_manifest(id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if not is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    try:
+        limit, after = get_page_args(request.args)
+    except Exception as e:
+        return Response("The page arguments are not valid", status=400, mimetype="application/json")
+
+    manifest = flight_manifest(ObjectId(id), limit, after)
+    if manifest == None:
+        return Response("No flight found", status=500, mimetype="application/json")
+    return jsonify(manifest_page(manifest, limit))
+
+
 #Update a flight route. Only available for admins.
-@app.route("/flights/<id>", methods=["PUT"])
+@routes.route("/flights/<id>", methods=["PUT"])
 def update_flights_byId(id):
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
@@ -315,24 +1068,43 @@ def update_flights_byId(id):
     if type(data["economyTicketCost"]) == str:
         return Response("Bad json content. EconomyTicketCost must be an integer", status=400, mimetype="application/json")
 
+    #The flight can also be moved to another date or airports, all of its bookings are changed with it
+    schedule = {}
+    try:
+        if "flightDate" in data:
+            schedule["flightDate"] = parse_flight_date(data["flightDate"])
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+    for field in ["departAirport", "destAirport"]:
+        if field in data:
+            if type(data[field]) != str or data[field].strip() == "":
+                return Response("Bad json content. " + field + " must be an airport", status=400, mimetype="application/json")
+            schedule[field] = escape(data[field])
+
     #Find the flight with the given id
-    flight = flights.find_one({"_id": ObjectId(id)})
-    if flight != None:
+    found = flights.find_one({"_id": ObjectId(id)})
+    if found != None:
         flight = {"_id": ObjectId(id)}
-        #Only the ticket costs can be changed
+        #Only the ticket costs and the schedule can be changed
         new_values = {
-            "$set": {
+            "$set": dict(schedule, **{
                 "businessTicketCost": data["businessTicketCost"],
                 "economyTicketCost": data["economyTicketCost"],
-            }
+            })
         }
         flights.update_one(flight, new_values)
-        return Response("Ticket costs were updated successfully", status=200, mimetype="application/json")
+        flights_changed()
+        route_index.add(dict(found, **new_values["$set"]))
+        if not schedule:
+            return Response("Ticket costs were updated successfully", status=200, mimetype="application/json")
+        #One update for all the bookings of the flight. If it fails, the reconciler repairs them later
+        sync_flight_bookings(bookings, dict(found, **new_values["$set"]))
+        return Response("Flight was updated successfully", status=200, mimetype="application/json")
     return Response("No flight found", status=500, mimetype="application/json")
 
 
 #Delete a flight route. Only available for admins.
-@app.route("/flights/<id>", methods=["DELETE"])
+@routes.route("/flights/<id>", methods=["DELETE"])
 def delete_flight(id):
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
@@ -350,12 +1122,14 @@ def delete_flight(id):
             return Response("You can't delete this flight, as there are bookings for it", status=200, mimetype="application/json")
         
         flights.delete_one(flight)
+        flights_changed()
+        route_index.remove(id)
         return Response("Flight was deleted successfully", status=200, mimetype="application/json")
     return Response("No flights found", status=500, mimetype="application/json")
 
 
 #Create a flight route. Only available for admins. The method GET returns the form and the method POST creates a flight
-@app.route("/flights/new", methods=["GET", "POST"])
+@routes.route("/flights/new", methods=["GET", "POST"])
 def create_flight():
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
@@ -377,39 +1151,14 @@ def create_flight():
         if data == None:
             return Response("bad request", status=400, mimetype="application/json")
         
-        #Necessary fields to create a flight
-        if (not "businessAvailableTickets" in data
-            or not "businessTicketCost" in data
-            or not "departAirport" in data
-            or not "destAirport" in data
-            or not "economyAvailableTickets" in data
-            or not "economyTicketCost" in data
-            or not "flightDate" in data
-        ):
-            return Response("Information incompleted", status=400, mimetype="application/json")
-
-        
-        try:
-            data["businessTicketCost"] = float(data["businessTicketCost"])
-            data["businessAvailableTickets"] = int(data["businessAvailableTickets"])
-            data["economyTicketCost"] = float(data["economyTicketCost"])
-            data["economyAvailableTickets"] = int(data["economyAvailableTickets"])
-        except Exception as e:
-            print(e)
-            return Response("Bad json content. The available tickets and costs must numbers", status=400, mimetype="application/json")
-       
-
         #Create a flight and add it to 'flights' collection
-        flight = {
-            "businessAvailableTickets": data["businessAvailableTickets"],
-            "businessTicketCost": data["businessTicketCost"],
-            "departAirport": escape(data["departAirport"]),
-            "destAirport": escape(data["destAirport"]),
-            "economyAvailableTickets": data["economyAvailableTickets"],
-            "economyTicketCost": data["economyTicketCost"],
-            "flightDate": escape(data["flightDate"]),
-        }
+        try:
+            flight = parse_flight(data)
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype="application/json")
         flights.insert_one(flight)
+        flights_changed()
+        route_index.add(flight)
         return Response("Flight was added successfully", status=200, mimetype="application/json")
     else:
         #HTML FORM
@@ -449,8 +1198,103 @@ def create_flight():
         '''
 
 
+#Import flights route. Only available for admins. Adds all the flights of a csv or json lines file, sent as the body or as the 'file' of a form
+@routes.route("/flights/import", methods=["POST"])
+def import_flights_file():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if not is_admin():
+            return Response("You are not authorized to enter this page!", status=403, mimetype="application/json")
+
+    format = request.args.get("format", "jsonl")
+    if format != "csv" and format != "jsonl":
+        return Response("The format must be csv or jsonl", status=400, mimetype="application/json")
+
+    #The file is read line by line while the flights are added
+    if "file" in request.files:
+        stream = request.files["file"].stream
+    else:
+        stream = request.stream
+    return jsonify(import_flights_stream(stream, format))
+
+
+def import_flights_stream(stream, format):
+    '''
+    Imports the flights of a binary stream in the given format and returns the report of import_flights()
+    '''
+    lines = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    report = None
+    try:
+        report = import_flights(flights, read_records(lines, format))
+    finally:
+        #The batches written before an error are already in the database, so the cached flights are dropped anyway
+        if report == None or report["inserted"] > 0:
+            flights_changed()
+            route_index.invalidate()
+    return report
+
+
+def report_args(args):
+    '''
+    Returns the format and the first and last flight date of an export. Raises ValueError with the message for the admin if they are not valid
+    '''
+    format = args.get("format", "csv")
+    if format not in FORMATS:
+        raise ValueError("The format must be csv or jsonl")
+    start = parse_flight_date(args["from"]) if "from" in args else None
+    end = parse_flight_date(args["to"]) if "to" in args else None
+    return format, start, end
+
+
+def report_response(chunks, name, format):
+    return Response(chunks, status=200, mimetype=FORMATS[format], headers={"Content-Disposition": "attachment; filename=" + name + "." + format})
+
+
+#Export of all the bookings, optionally of the flights from one date to another. Only available for admins
+@routes.route("/reports/bookings", methods=["GET"])
+def export_bookings():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if not is_admin():
+            return Response("You are not authorized to enter this page!", status=403, mimetype="application/json")
+    try:
+        format, start, end = report_args(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+
+    #The bookings are read from a secondary in batches and written while they arrive
+    cursor = for_reports(bookings).find(date_filter(start, end), {column: 1 for column in BOOKING_COLUMNS}, batch_size=REPORT_BATCH_SIZE)
+    return report_response(export(cursor, BOOKING_COLUMNS, format, json_default), "bookings", format)
+
+
+#Export of the seats sold, the load factor and the revenue of every flight, or of every route or date with group=route or group=date.
+#Only available for admins
+@routes.route("/reports/load-factors", methods=["GET"])
+def export_load_factors():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if not is_admin():
+            return Response("You are not authorized to enter this page!", status=403, mimetype="application/json")
+    group = request.args.get("group", "flight")
+    if group not in LOAD_FACTOR_GROUPS:
+        return Response("The group must be flight, route or date", status=400, mimetype="application/json")
+    try:
+        format, start, end = report_args(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+
+    #Computed by one aggregation on a secondary, which can use the disk to group many flights
+    rows = for_reports(flights).aggregate(load_factor_pipeline(group, start, end), allowDiskUse=True, batchSize=REPORT_BATCH_SIZE)
+    if group != "flight":
+        rows = group_rows(rows)
+    return report_response(export(rows, LOAD_FACTOR_GROUPS[group], format, json_default), "load-factors-" + group, format)
+
+
 #Create a booking for a flight route. Only available to users. The method GET returns the form and the method POST creates a booking
-@app.route("/bookings/new/<flight_id>", methods=["GET", "POST"])
+@routes.route("/bookings/new/<flight_id>", methods=["GET", "POST"])
 def post_new_booking(flight_id):
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
@@ -474,63 +1318,26 @@ def post_new_booking(flight_id):
         if data == None:
             return Response("bad request", status=400, mimetype="application/json")
         
-        #Necessary fields to create a booking
-        if (
-            not "firstName" in data
-            or not "lastName" in data
-            or not "email" in data
-            or not "passportNo" in data
-            or not "birthDate" in data
-            or not "ticketType" in data
-        ):
-            return Response("Information incompleted", status=400, mimetype="application/json")
+        error = booking_error(data)
+        if error != None:
+            return Response(error, status=400, mimetype="application/json")
 
-        #Ticket type must be only 'economy' or 'business'
-        if (data["ticketType"] != "economy" and data["ticketType"] != "business"):
-            return Response("Ticket Type must business or economy", status=400, mimetype="application/json")
-        
-        #Find the flight with te given id
-        flight = flights.find_one({"_id": ObjectId(flight_id)})
-        if flight != None:
-            #Check if there are tickets left
-            if (data["ticketType"] == "economy" and int(flight["economyAvailableTickets"]) == 0):
-                return Response("Not Available Tickets left!", status=200, mimetype="application/json")
-            elif (data["ticketType"] == "business" and int(flight["businessAvailableTickets"]) == 0):
-                return Response("Not Available Tickets left!", status=200, mimetype="application/json")
-            
-            #We add the flightID to demonstrate the One-to-Many relationship with the 'flights' collection
-            booking = {
-                "firstName": escape(data["firstName"]),
-                "lastName": escape(data["lastName"]),
-                "passportNo": escape(data["passportNo"]),
-                "birthDate": escape(data["birthDate"]),
-                "email": escape(data["email"]),
-                "ticketType": escape(data["ticketType"]),
-                "departAirport": flight["departAirport"],
-                "destAirport": flight["destAirport"],
-                "flightDate": flight["flightDate"],
-                "flightID": ObjectId(flight_id),
-            }
-
-            #Add booking to 'bookings' collection
-            bookings.insert_one(booking)
+        #Take a seat on the flight, only if there are tickets left
+        flight = reserve_seat(ObjectId(flight_id), data["ticketType"])
+        if flight == None:
+            if flights.count_documents({"_id": ObjectId(flight_id)}, limit=1) == 0:
+                return Response("No flight found", status=500, mimetype="application/json")
+            return Response("Not Available Tickets left!", status=200, mimetype="application/json")
 
-            #Update the available tickets for this flight
-            if data["ticketType"] == "economy":
-                tickets = int(flight["economyAvailableTickets"]) - 1
-                print(tickets)
-                flights.update_one(
-                    {"_id": ObjectId(flight_id)},
-                    {"$set": {"economyAvailableTickets": tickets}},
-                )
-            elif data["ticketType"] == "business":
-                tickets = flight["businessAvailableTickets"] - 1
-                flights.update_one(
-                    {"_id": ObjectId(flight_id)},
-                    {"$set": {"businessAvailableTickets": tickets}},
-                )
-            return Response("You successfully booked the ticket!", status=200, mimetype="application/json")
-        return Response("No flight found", status=500, mimetype="application/json")
+        booking = make_booking(data, flight, ObjectId(flight_id))
+
+        #Add booking to 'bookings' collection. If that fails the seat is given back
+        try:
+            bookings.insert_one(booking)
+        except Exception:
+            release_seat(ObjectId(flight_id), data["ticketType"])
+            raise
+        return Response("You successfully booked the ticket!", status=200, mimetype="application/json")
     else: 
         #HTML FORM
         return ''' 
@@ -551,30 +1358,56 @@ def post_new_booking(flight_id):
         </form>
         '''
 
+#Create the bookings of a group of passengers for a flight route, all of them or none. Only available to users.
+#The body is a json object with the list of the passengers, each one with the same fields as a single booking
+@routes.route("/bookings/group/<flight_id>", methods=["POST"])
+def post_group_booking(flight_id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    try:
+        flight_id = ObjectId(flight_id)
+        data = json.loads(request.data)
+    except Exception as e:
+        return Response("bad json content", status=400, mimetype="application/json")
+
+    try:
+        passengers, seats = group_seats(data)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+
+    if uses_transactions():
+        with client.start_session() as db_session:
+            group = db_session.with_transaction(lambda db_session: book_group(flight_id, passengers, seats, db_session))
+    else:
+        group = book_group(flight_id, passengers, seats)
+    if group == None:
+        if flights.count_documents({"_id": flight_id}, limit=1) == 0:
+            return Response("No flight found", status=500, mimetype="application/json")
+        return Response("Not enough Available Tickets left!", status=200, mimetype="application/json")
+    return jsonify({"bookings": [str(booking["_id"]) for booking in group]})
+
 #Bookings route. Returns all the bookings done by the user. Only available for users
-@app.route("/bookings", methods=["GET"])
+@routes.route("/bookings", methods=["GET"])
 def get_bookings():
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
     else:
         if is_admin():
             return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
-    
-    #Get the information of the connected user
-    user = users.find_one({"username": session["username"]})
-    #Find all the bookings with the user's email
-    iterable = bookings.find({"email": user["email"]})
-    if iterable != None:
-        output = []
-        for booking in iterable:
-            booking["_id"] = str(booking["_id"])
-            booking["flightID"] = str(booking["flightID"])
-            output.append(booking)
-        return jsonify(output)
-    return Response("No bookings found", status=500, mimetype="application/json")
+    try:
+        limit, after = get_page_args(request.args)
+    except Exception as e:
+        return Response("The page arguments are not valid", status=400, mimetype="application/json")
+
+    #Find the bookings with the email of the connected user
+    iterable = find_page(bookings, {"email": session["email"]}, None, limit, after)
+    return Response(stream_json_page(iterable, "bookings", limit), status=200, mimetype="application/json")
 
 #Specific booking route. Returns all the information of a specific booking of the user. Only available to users
-@app.route("/bookings/<id>", methods=["GET"])
+@routes.route("/bookings/<id>", methods=["GET"])
 def get_booking_byID(id):
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
@@ -584,12 +1417,10 @@ def get_booking_byID(id):
     if id == None:
         return Response("Bad request", status=400, mimetype="application/json")
 
-    #Get the information of the connected user
-    user = users.find_one({"username": session["username"]})
     booking = bookings.find_one({"_id": ObjectId(id)})
     if booking != None:
         #Check if the booking was done by the connected user
-        if booking["email"] == user["email"]:
+        if booking["email"] == session["email"]:
             booking["_id"] = str(booking["_id"])
             booking["flightID"] = str(booking["flightID"])
             return jsonify(booking)
@@ -598,7 +1429,7 @@ def get_booking_byID(id):
     return Response("No bookings found", status=500, mimetype="application/json")
 
 #Delete a booking route. Only available to users
-@app.route("/bookings/<id>", methods=["DELETE"])
+@routes.route("/bookings/<id>", methods=["DELETE"])
 def delete_booking_byID(id):
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
@@ -608,31 +1439,18 @@ def delete_booking_byID(id):
     if id == None:
         return Response("Bad request", status=500, mimetype="application/json")
     
-    #Get the information of the connected user
-    user = users.find_one({"username": session["username"]})
-    booking = bookings.find_one({"_id": ObjectId(id)})
+    #Delete the booking only if it was done by the connected user
+    booking = bookings.find_one_and_delete({"_id": ObjectId(id), "email": session["email"]})
     if booking != None:
-        #Check if the booking was done by the connected user
-        if booking["email"] == user["email"]:
-            bookings.delete_one(booking)
-
-            #Update the available tickets left of the corresponding flight
-            flight = flights.find_one({"_id": booking["flightID"]})
-            if booking["ticketType"] == "economy":
-                ticket = int(flight["economyAvailableTickets"]) + 1
-                flights.update_one({"_id": booking["flightID"]}, {"$set": {"economyAvailableTickets": ticket}})
-
-            elif booking["ticketType"] == "business":
-                ticket = int(flight["businessAvailableTickets"]) + 1
-                flights.update_one({"_id": booking["flightID"]}, {"$set": {"businessAvailableTickets": ticket}})
-
-            return Response("Booking was deleted successfully!", status=200, mimetype="application/json")
-        else:
-            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+        #Update the available tickets left of the corresponding flight
+        release_seat(booking["flightID"], booking["ticketType"])
+        return Response("Booking was deleted successfully!", status=200, mimetype="application/json")
+    if bookings.count_documents({"_id": ObjectId(id)}, limit=1) != 0:
+        return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
     return Response("no bookings found", status=500, mimetype="application/json")
 
 #Delete user route. Only available for users
-@app.route("/user/delete", methods=["DELETE"])
+@routes.route("/user/delete", methods=["DELETE"])
 def delete_user():
     if not is_logged_in():
         return Response("You must login in this page", status=401, mimetype="application/json")
@@ -640,17 +1458,47 @@ def delete_user():
         if is_admin():
             return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
     
-    #Get the information of the connected user
-    user = users.find_one({"username": session["username"]})
-    if user != None:
-        users.delete_one(user)
-        #Deletes the active session of the user
-        session.pop("username", None)
-        return Response("Was deleted", status=200, mimetype="application/json")
-    return Response("No users found", status=500, mimetype="application/json")
+    #The user and their bookings are deleted in the background, the seats of the bookings are given back to the flights
+    user = users.find_one({"_id": ObjectId(session["userId"])}, {"email": 1})
+    if user == None:
+        return Response("No users found", status=500, mimetype="application/json")
+    job = deletions.request(user)
+    #Deletes the active session of the user and every other session they have. The new session only keeps the id
+    #of the deletion, so the user can still follow it
+    current_app.session_interface.revoke_user(session["username"])
+    session.clear()
+    session.regenerate()
+    session["deletion"] = str(job["_id"])
+    location = "/user/delete/" + str(job["_id"])
+    return Response(json.dumps({"id": str(job["_id"]), "status": job["status"], "location": location}), status=202, mimetype="application/json", headers={"Location": location})
+
+
+#Progress of the deletion of a user. The id is the one returned when the deletion was requested.
+#Only available to the user that asked for it (in the session that asked) and to admins
+@routes.route("/user/delete/<id>", methods=["GET"])
+def user_deletion_status(id):
+    if not is_logged_in() and not "deletion" in session:
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    #Admins see every deletion, and a user only their own
+    if not is_admin() and session.get("deletion") != id:
+        return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    if id == None:
+        return Response("Bad request", status=400, mimetype="application/json")
+    job = deletions.status(ObjectId(id))
+    if job == None:
+        return Response("No deletion found", status=500, mimetype="application/json")
+    job["_id"] = str(job["_id"])
+    return jsonify(job)
                 
 
 
-# Run Flask App
+# Run Flask App. With SERVER_MODE=production it runs in gunicorn with many workers and threads (see gunicorn.conf.py),
+# otherwise in the Flask development server
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    if os.environ.get("SERVER_MODE") == "production":
+        os.execvp("gunicorn", ["gunicorn", "--config", "gunicorn.conf.py", "app:create_app()"])
+    elif os.environ.get("SERVER_MODE") == "async":
+        #The async routes of async_app.py, in the ASGI server hypercorn
+        os.execvp("hypercorn", ["hypercorn", "--config", "file:hypercorn.conf.py", "async_app:create_app()"])
+    else:
+        create_app().run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,632 @@
+'''
+Async serving mode of the service. The routes that users call the most (login, flights, bookings) are async handlers
+over the async driver of pymongo, so a request that waits on MongoDB doesn't hold a thread and one process can
+serve thousands of connections. Every other route (the forms, registration and the admin routes that change flights)
+is answered by the Flask app of app.py in a pool of threads, so the service has the same URLs in both modes.
+Both apps share the sessions, the cache of the flight search results and the network of flights.
+
+It runs in an ASGI server:
+    hypercorn --bind 0.0.0.0:5000 "async_app:create_app()"
+'''
+from quart import Quart, Blueprint, request, jsonify, Response, session, g
+from quart.sessions import SessionInterface
+from quart.wrappers.request import Body, Request
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from pymongo.errors import PyMongoError
+from bson.objectid import ObjectId
+import asyncio, json, os, tempfile, time
+
+import app as service
+from database import create_async_client
+from passwords import HasherBusy
+from ratelimit import RedisBuckets, retry_after_seconds
+from cache import RedisCache
+from versions import FLIGHTS
+
+#The routes answered by the Flask app get their whole body in memory first, so their bodies are limited to this size.
+#The async routes have the limit of Quart (MAX_CONTENT_LENGTH, 16 MB), except the flight import, which can be much larger
+WSGI_MAX_BODY_SIZE = int(os.environ.get("WSGI_MAX_BODY_SIZE", 1024 * 1024))
+#Largest file of flights that can be imported, and how much of it is kept in memory before it is written to disk
+IMPORT_MAX_SIZE = int(os.environ.get("IMPORT_MAX_SIZE", 1024 * 1024 * 1024))
+IMPORT_SPOOL_SIZE = 1024 * 1024
+
+# The async database is set by connect(), when the server starts
+client = None
+db = None
+users = None
+flights = None
+bookings = None
+versions = None
+
+# The async routes. They have the same names as the routes of app.py that they replace
+routes = Blueprint("routes", __name__)
+
+
+async def connect():
+    '''
+    Connects to our MongoDB with the async driver. It runs in the event loop of the server, before the first request
+    '''
+    global client, db, users, flights, bookings, versions
+    client = create_async_client([service.pool_stats, service.metrics, service.gate])
+    db = client["DigitalAirlines"]
+    users = db["Users"]
+    flights = db["Flights"]
+    bookings = db["Bookings"]
+    versions = db["Versions"]
+
+
+async def close():
+    await client.close()
+
+
+class AsyncSessionInterface(SessionInterface):
+    '''
+    Opens and saves the sessions with the session interface of the Flask app, so a user logged in
+    through one app is logged in through the other. The store is in the process or in Redis. The calls to Redis
+    would block the event loop, so with Redis the session is opened and saved in a thread
+    '''
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.blocking = isinstance(interface.store, RedisCache)
+
+    async def call(self, function, *args):
+        if self.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def open_session(self, app, request):
+        return await self.call(self.interface.open_session, app, request)
+
+    async def save_session(self, app, session, response):
+        await self.call(self.interface.save_session, app, session, response)
+
+
+class ResizableBody(Body):
+    '''
+    Body of a request whose size limit the route can raise before it reads the body, up to IMPORT_MAX_SIZE.
+    The body that arrives is refused only above IMPORT_MAX_SIZE, the limit of the route is checked while it is read
+    '''
+
+    def __init__(self, expected_content_length, max_content_length):
+        super().__init__(expected_content_length, max(max_content_length, IMPORT_MAX_SIZE) if max_content_length != None else None)
+        self.expected_content_length = expected_content_length
+        self.limit = max_content_length
+        self.read = 0
+
+    def resize(self, max_content_length):
+        self.limit = max_content_length
+
+    def check_length(self, length):
+        if self.limit != None and max(length, self.expected_content_length or 0) > self.limit:
+            raise RequestEntityTooLarge()
+
+    async def __anext__(self):
+        self.check_length(self.read)
+        data = await super().__anext__()
+        self.read += len(data)
+        self.check_length(self.read)
+        return data
+
+    def __await__(self):
+        self.check_length(self.read)
+        data = yield from super().__await__()
+        self.check_length(len(data))
+        return data
+
+
+class ResizableRequest(Request):
+    '''
+    Request whose body limit is also raised when a route sets its max_content_length
+    '''
+    body_class = ResizableBody
+
+    @property
+    def max_content_length(self):
+        return Request.max_content_length.fget(self)
+
+    @max_content_length.setter
+    def max_content_length(self, value):
+        Request.max_content_length.fset(self, value)
+        self.body.resize(value)
+
+
+class Dispatcher:
+    '''
+    Sends every request of a route and method that has an async handler to the Quart app and all the others to the Flask app.
+    Both apps must find the same route, since the Flask app has routes that the Quart app doesn't
+    (for example /flights/new, which the Quart app alone would take for /flights/<id>)
+    '''
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.fallback = AsyncioWSGIMiddleware(wsgi_app, max_body_size=WSGI_MAX_BODY_SIZE)
+
+    def is_async(self, path, method):
+        try:
+            endpoint, args = self.wsgi_app.url_map.bind("localhost").match(path, method)
+            return self.app.url_map.bind("localhost").match(path, method)[0] == endpoint
+        except HTTPException:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not self.is_async(scope["path"], scope["method"]):
+            return await self.fallback(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+
+def create_app():
+    '''
+    Creates the ASGI app of the async serving mode, with the Flask app of app.py for the routes that are not async
+    '''
+    wsgi_app = service.create_app()
+    app = Quart(__name__)
+    app.json = service.JSONProvider(app)
+    app.request_class = ResizableRequest
+    app.secret_key = wsgi_app.secret_key
+    app.permanent_session_lifetime = wsgi_app.permanent_session_lifetime
+    app.session_interface = AsyncSessionInterface(wsgi_app.session_interface)
+    app.register_blueprint(routes)
+    app.before_serving(connect)
+    app.after_serving(close)
+    app.before_request(start_timer)
+    app.before_request(admit)
+    app.after_request(record_latency)
+    app.teardown_request(release)
+    return Dispatcher(app, wsgi_app)
+
+
+async def start_timer():
+    g.start = time.perf_counter()
+    service.metrics.start_request()
+
+
+async def record_latency(response):
+    '''
+    Records the latency of the request for the route. Many requests run at once in the same thread, but every one
+    runs in its own task, so the operations on the database are counted per request through the context of the task
+    '''
+    route = request.url_rule.rule if request.url_rule != None else "unmatched"
+    service.metrics.end_request(route, request.method, response.status_code, time.perf_counter() - g.start)
+    return response
+
+
+async def admit():
+    '''
+    Same as admit of app.py: the rate limits of the routes and the admission gate, shared with the Flask app
+    '''
+    route = request.endpoint.split(".")[-1] if request.endpoint != None else None
+    if route in service.UNGATED_ROUTES:
+        return None
+    wait = 0
+    if route in service.limiter.limits:
+        args = (route, request.remote_addr, session.get("username"))
+        #The token buckets in Redis are taken in a thread, so the event loop isn't blocked
+        if isinstance(service.limiter.buckets, RedisBuckets):
+            wait = await asyncio.to_thread(service.limiter.check, *args)
+        else:
+            wait = service.limiter.check(*args)
+    if wait > 0:
+        return Response("Too many requests, please try again later", status=429, mimetype="application/json",
+                        headers={"Retry-After": retry_after_seconds(wait)})
+    refused = service.gate.enter(route not in service.UNMEASURED_ROUTES)
+    if refused != None:
+        return Response(refused, status=503, mimetype="application/json", headers={"Retry-After": str(service.gate.retry_after)})
+    g.admitted = True
+
+
+async def release(error=None):
+    if g.pop("admitted", False):
+        service.gate.leave()
+
+
+def is_logged_in():
+    return "username" in session
+
+
+def is_user():
+    return session.get("type") == "User"
+
+
+def is_admin():
+    return session.get("type") == "Admin"
+
+
+async def reserve_seats(flight_id, seats, db_session=None):
+    '''
+    Same as reserve_seats of app.py. Returns the route of the flight, or None if there aren't enough seats
+    '''
+    query, update = service.seat_reservation(flight_id, seats)
+    return await flights.find_one_and_update(query, update, projection=service.BOOKED_FLIGHT_FIELDS, session=db_session)
+
+
+async def release_seats(flight_id, seats):
+    await flights.update_one({"_id": flight_id}, service.seat_release(seats))
+
+
+async def book_group(flight_id, passengers, seats, db_session=None):
+    '''
+    Same as book_group of app.py. Returns the bookings, or None if there aren't enough seats for the whole group
+    '''
+    flight = await reserve_seats(flight_id, seats, db_session)
+    if flight == None:
+        return None
+    group = [service.make_booking(passenger, flight, flight_id) for passenger in passengers]
+    try:
+        await bookings.insert_many(group, session=db_session)
+    except Exception:
+        if db_session == None:
+            await bookings.delete_many(service.written_bookings(group))
+            await release_seats(flight_id, seats)
+        raise
+    return group
+
+
+async def flight_manifest(flight_id, limit=None, after=None):
+    '''
+    Same as flight_manifest of app.py, with the same aggregation. Returns None if there is no such flight
+    '''
+    async for manifest in await flights.aggregate(service.flight_manifest_pipeline(flight_id, limit, after)):
+        return manifest
+    return None
+
+
+#Health route. Checks that MongoDB answers
+@routes.route("/health", methods=["GET"])
+async def health():
+    try:
+        await client.admin.command("ping")
+    except PyMongoError as e:
+        return Response(json.dumps({"status": "unavailable", "error": str(e), "pool": service.pool_stats.report()}), status=503, mimetype="application/json")
+    return jsonify({"status": "ok", "pool": service.pool_stats.report()})
+
+
+#Login route. The form of the method GET is returned by the Flask app
+@routes.route("/login", methods=["POST"])
+async def login():
+    form = await request.form
+    data = None
+    try:
+        #determine if data is from a form or from json (aka POSTMAN)
+        if form:
+            data = form
+        else:
+            data = json.loads(await request.get_data())
+    except Exception as e:
+        return Response("bad json content", status=400, mimetype="application/json")
+    if data == None:
+        return Response("bad request", status=400, mimetype="application/json")
+
+    #Check if user provided the necessary credentials
+    if not "email" in data or not "password" in data:
+        return Response("Information incomplete", status=400, mimetype="application/json")
+
+    user = await users.find_one(service.login_query(data))
+    #The password is checked in the pool of the hasher, so the event loop keeps serving other requests
+    try:
+        valid, new_hash = await asyncio.wrap_future(service.hasher.check(str(data["password"]), user.get("password"))) if user != None else (False, None)
+    except HasherBusy:
+        return Response("Too many logins at the moment, please try again later", status=503, mimetype="application/json")
+    if valid:
+        if new_hash != None:
+            await users.update_one({"_id": user["_id"], "password": user["password"]}, {"$set": {"password": new_hash}})
+        service.start_user_session(session, user)
+        return Response("Welcome", status=200, mimetype="application/json")
+    return Response("Invalid credentials. Please try again!", status=401, mimetype="application/json")
+
+
+#Logout route. Deletes the active session for the user
+@routes.route("/logout", methods=["GET"])
+async def logout():
+    if "username" in session:
+        session.clear()
+        return Response("You logged out successfully!", status=200, mimetype="application/json")
+    else:
+        return Response("You are already logged out!", status=200, mimetype="application/json")
+
+
+#Flights route. Available for both simple user and admin
+@routes.route("/flights", methods=["GET"])
+async def get_flights():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    args = request.args
+    try:
+        limit, after = service.get_page_args(args)
+    except Exception as e:
+        return Response("The page arguments are not valid", status=400, mimetype="application/json")
+    try:
+        query = service.flight_search_query(args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+
+    #The version of the flights is shared with app.py, it is read from MongoDB at most every FLIGHT_VERSION_TTL seconds
+    version = service.flight_version.current()
+    if version == None:
+        version = service.flight_version.load(await versions.find_one({"_id": FLIGHTS}))
+    cached = service.flight_page_cached(request.if_none_match, version)
+    if cached != None:
+        return Response("", status=304, headers=service.flight_page_headers(version, cached))
+
+    #The same search is answered from the cache until a flight changes
+    key = (version, tuple(sorted(query.items())), limit, str(after))
+    page = service.flight_cache.get(key)
+    if page == None:
+        documents = await service.find_page(flights, query, service.FLIGHT_LIST_FIELDS, limit, after).to_list()
+        page = "".join(service.stream_json_page(documents, "flights", limit))
+        service.flight_cache.set(key, page)
+    body, compressed = service.flight_page_body(key, page, request.accept_encodings)
+    headers = service.flight_page_headers(version, compressed)
+    if compressed:
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, status=200, mimetype="application/json", headers=headers)
+
+
+#Import flights route. Only available for admins. The body is written to a temporary file while it arrives
+#(in memory up to IMPORT_SPOOL_SIZE, then on disk), and the file is imported in a thread by the code of app.py
+@routes.route("/flights/import", methods=["POST"])
+async def import_flights_file():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    if not is_admin():
+        return Response("You are not authorized to enter this page!", status=403, mimetype="application/json")
+    #Only the admins that import flights can send bodies larger than the limit of the app
+    request.max_content_length = IMPORT_MAX_SIZE
+
+    format = request.args.get("format", "jsonl")
+    if format != "csv" and format != "jsonl":
+        return Response("The format must be csv or jsonl", status=400, mimetype="application/json")
+
+    if request.mimetype == "multipart/form-data":
+        #Quart writes uploaded files to disk too
+        files = await request.files
+        if not "file" in files:
+            return Response("The file of the flights is missing", status=400, mimetype="application/json")
+        stream = files["file"].stream
+    else:
+        stream = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+        async for chunk in request.body:
+            stream.write(chunk)
+        stream.seek(0)
+    try:
+        report = await asyncio.to_thread(service.import_flights_stream, stream, format)
+    finally:
+        stream.close()
+    return jsonify(report)
+
+
+#Fare calendar route. Available for both simple user and admin
+@routes.route("/flights/calendar", methods=["GET"])
+async def get_fare_calendar():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    args = request.args
+    try:
+        pipeline = service.fare_calendar_pipeline(args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+    output = []
+    async for day in await flights.aggregate(pipeline):
+        day["flightDate"] = day.pop("_id")
+        output.append(day)
+    return jsonify({"departAirport": args.get("departAirport"), "destAirport": args.get("destAirport"), "days": output})
+
+
+#Seats stream route. Same as in app.py, but a client waiting for changes doesn't hold a thread,
+#so this mode can serve many more of them
+@routes.route("/flights/seats", methods=["GET"])
+async def get_seat_stream():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    try:
+        flight_ids = service.parse_seat_subscription(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+
+    #The feed runs in its own thread, so it wakes this request up through the event loop
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    subscriber = service.seat_feed.subscribe([str(id) for id in flight_ids], lambda: loop.call_soon_threadsafe(wake.set))
+    try:
+        snapshot = {str(flight.pop("_id")): flight async for flight in flights.find({"_id": {"$in": flight_ids}}, service.SEAT_FIELDS)}
+    except Exception:
+        service.seat_feed.unsubscribe(subscriber)
+        raise
+
+    async def stream():
+        try:
+            for event in service.seat_events(snapshot):
+                yield event
+            while True:
+                try:
+                    await asyncio.wait_for(wake.wait(), service.SEAT_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                changes = subscriber.take()
+                if changes:
+                    for event in service.seat_events(changes):
+                        yield event
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            service.seat_feed.unsubscribe(subscriber)
+
+    response = Response(stream(), status=200, mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    #The stream stays open until the client leaves
+    response.timeout = None
+    return response
+
+
+#Specific flight route. Admins also get the passengers of the flight
+@routes.route("/flights/<id>", methods=["GET"])
+async def get_flights_byId(id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+
+    if is_admin():
+        manifest = await flight_manifest(ObjectId(id))
+        if manifest != None:
+            return jsonify(service.manifest_details(manifest))
+    elif is_user():
+        flight = await flights.find_one({"_id": ObjectId(id)}, service.HIDDEN_FLIGHT_FIELDS)
+        if flight != None:
+            flight["_id"] = str(flight["_id"])
+            return jsonify(flight)
+    return Response("No flight found", status=500, mimetype="application/json")
+
+
+#Flight manifest route. Only available for admins
+@routes.route("/flights/<id>/manifest", methods=["GET"])
+async def get_flight_manifest(id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if not is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    try:
+        limit, after = service.get_page_args(request.args)
+    except Exception as e:
+        return Response("The page arguments are not valid", status=400, mimetype="application/json")
+
+    manifest = await flight_manifest(ObjectId(id), limit, after)
+    if manifest == None:
+        return Response("No flight found", status=500, mimetype="application/json")
+    return jsonify(service.manifest_page(manifest, limit))
+
+
+#Create a booking for a flight route. Only available to users. The form of the method GET is returned by the Flask app
+@routes.route("/bookings/new/<flight_id>", methods=["POST"])
+async def post_new_booking(flight_id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+
+    form = await request.form
+    data = None
+    try:
+        #Determine if data is from a form or from json (aka POSTMAN)
+        if form:
+            data = form
+        else:
+            data = json.loads(await request.get_data())
+    except Exception as e:
+        return Response("bad json content", status=400, mimetype="application/json")
+    if data == None:
+        return Response("bad request", status=400, mimetype="application/json")
+
+    error = service.booking_error(data)
+    if error != None:
+        return Response(error, status=400, mimetype="application/json")
+
+    #Take a seat on the flight, only if there are tickets left
+    seats = {data["ticketType"]: 1}
+    flight = await reserve_seats(ObjectId(flight_id), seats)
+    if flight == None:
+        if await flights.count_documents({"_id": ObjectId(flight_id)}, limit=1) == 0:
+            return Response("No flight found", status=500, mimetype="application/json")
+        return Response("Not Available Tickets left!", status=200, mimetype="application/json")
+
+    #Add booking to 'bookings' collection. If that fails the seat is given back
+    try:
+        await bookings.insert_one(service.make_booking(data, flight, ObjectId(flight_id)))
+    except Exception:
+        await release_seats(ObjectId(flight_id), seats)
+        raise
+    return Response("You successfully booked the ticket!", status=200, mimetype="application/json")
+
+
+#Create the bookings of a group of passengers for a flight route, all of them or none. Only available to users
+@routes.route("/bookings/group/<flight_id>", methods=["POST"])
+async def post_group_booking(flight_id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    try:
+        flight_id = ObjectId(flight_id)
+        data = json.loads(await request.get_data())
+    except Exception as e:
+        return Response("bad json content", status=400, mimetype="application/json")
+    try:
+        passengers, seats = service.group_seats(data)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="application/json")
+
+    #The first time it is asked with the client of app.py, in a thread so the event loop doesn't wait for it
+    transactions = service.transactions
+    if transactions == None:
+        transactions = await asyncio.to_thread(service.uses_transactions)
+    if transactions:
+        async with client.start_session() as db_session:
+            group = await db_session.with_transaction(lambda db_session: book_group(flight_id, passengers, seats, db_session))
+    else:
+        group = await book_group(flight_id, passengers, seats)
+    if group == None:
+        if await flights.count_documents({"_id": flight_id}, limit=1) == 0:
+            return Response("No flight found", status=500, mimetype="application/json")
+        return Response("Not enough Available Tickets left!", status=200, mimetype="application/json")
+    return jsonify({"bookings": [str(booking["_id"]) for booking in group]})
+
+
+#Bookings route. Returns all the bookings done by the user. Only available for users
+@routes.route("/bookings", methods=["GET"])
+async def get_bookings():
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    try:
+        limit, after = service.get_page_args(request.args)
+    except Exception as e:
+        return Response("The page arguments are not valid", status=400, mimetype="application/json")
+
+    documents = await service.find_page(bookings, {"email": session["email"]}, None, limit, after).to_list()
+    return Response("".join(service.stream_json_page(documents, "bookings", limit)), status=200, mimetype="application/json")
+
+
+#Specific booking route. Only available to users
+@routes.route("/bookings/<id>", methods=["GET"])
+async def get_booking_byID(id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+
+    booking = await bookings.find_one({"_id": ObjectId(id)})
+    if booking != None:
+        #Check if the booking was done by the connected user
+        if booking["email"] == session["email"]:
+            booking["_id"] = str(booking["_id"])
+            booking["flightID"] = str(booking["flightID"])
+            return jsonify(booking)
+        else:
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    return Response("No bookings found", status=500, mimetype="application/json")
+
+
+#Delete a booking route. Only available to users
+@routes.route("/bookings/<id>", methods=["DELETE"])
+async def delete_booking_byID(id):
+    if not is_logged_in():
+        return Response("You must login in this page", status=401, mimetype="application/json")
+    else:
+        if is_admin():
+            return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+
+    #Delete the booking only if it was done by the connected user
+    booking = await bookings.find_one_and_delete({"_id": ObjectId(id), "email": session["email"]})
+    if booking != None:
+        #Update the available tickets left of the corresponding flight
+        await release_seats(booking["flightID"], {booking["ticketType"]: 1})
+        return Response("Booking was deleted successfully!", status=200, mimetype="application/json")
+    if await bookings.count_documents({"_id": ObjectId(id)}, limit=1) != 0:
+        return Response("You are not authorized to enter this page", status=403, mimetype="application/json")
+    return Response("no bookings found", status=500, mimetype="application/json")
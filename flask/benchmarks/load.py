@@ -0,0 +1,248 @@
+'''
+Load test of the service. It creates the app in this process, fills the database with data made from
+the templates of data/seeds.py and replays a mix of requests through the Flask test client.
+For every route it reports the p50/p95/p99 latency, the requests per second and the operations on the database per request.
+
+By default the database is mongomock, so nothing has to run and no network is used:
+    python benchmarks/load.py --output results.json
+With --mongo local it uses the MongoDB of MONGO_HOSTNAME (for example a mongod started locally).
+The DigitalAirlines database is emptied first, so --reset must also be given.
+'''
+import argparse, json, os, random, sys, time
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FLASK_DIR)
+sys.path.insert(0, os.path.join(FLASK_DIR, "data"))
+
+import pymongo
+from datetime import datetime
+
+
+def count_mongomock_operations(metrics):
+    '''
+    mongomock doesn't send commands, so the command listener of the app never runs.
+    Instead every call to a method of a collection is counted as one operation of the current request
+    '''
+    import mongomock
+
+    #mongomock methods call each other (find_one calls find), so only the outermost call is counted
+    depth = {"calls": 0}
+
+    def counted(method):
+        def wrapper(*args, **kwargs):
+            if depth["calls"] == 0:
+                metrics.count_operation()
+            depth["calls"] += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                depth["calls"] -= 1
+        return wrapper
+
+    for name in ["find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "delete_one", "delete_many",
+                 "find_one_and_update", "find_one_and_delete", "count_documents", "aggregate", "bulk_write"]:
+        setattr(mongomock.Collection, name, counted(getattr(mongomock.Collection, name)))
+
+
+def seed(db, n_users, n_flights, n_bookings, rng):
+    '''
+    Fills the database with n_users users, n_flights flights and n_bookings bookings, made from the data of seeds.py.
+    Returns the ids of the flights
+    '''
+    import seeds
+
+    airports = ["ATH", "BCN", "SKG", "LHR", "CDG", "FCO", "MAD", "AMS", "FRA", "MUC", "VIE", "ZRH", "BRU", "LIS", "DUB", "CPH"]
+    template = seeds.users[0]
+    users = []
+    for i in range(n_users):
+        user = dict(template, username="user" + str(i), email="user" + str(i) + "@example.com", passportNo=str(100000 + i))
+        users.append(user)
+    for admin in [u for u in seeds.users if u["type"] == "Admin"]:
+        users.append(dict(admin))
+    db["Users"].insert_many(users)
+
+    flights = []
+    for i in range(n_flights):
+        depart, dest = rng.sample(airports, 2)
+        flight = dict(
+            seeds.flight,
+            departAirport=depart,
+            destAirport=dest,
+            flightDate=datetime(2023, rng.randint(6, 9), rng.randint(1, 28)),
+            businessAvailableTickets=10 ** 6,
+            economyAvailableTickets=10 ** 6,
+        )
+        flights.append(flight)
+    flight_ids = db["Flights"].insert_many(flights).inserted_ids
+
+    bookings = []
+    for i in range(n_bookings):
+        user = rng.choice(users[:n_users])
+        flight = rng.randrange(n_flights)
+        bookings.append({
+            "firstName": "First",
+            "lastName": "Last",
+            "passportNo": user["passportNo"],
+            "birthDate": user["birthDate"],
+            "email": user["email"],
+            "ticketType": rng.choice(["economy", "business"]),
+            "departAirport": flights[flight]["departAirport"],
+            "destAirport": flights[flight]["destAirport"],
+            "flightDate": flights[flight]["flightDate"],
+            "flightID": flight_ids[flight],
+        })
+    if bookings:
+        db["Bookings"].insert_many(bookings)
+    return [str(id) for id in flight_ids], flights
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the Digital Airlines service")
+    parser.add_argument("--mongo", choices=["mock", "local"], default="mock", help="mongomock, or the MongoDB of MONGO_HOSTNAME")
+    parser.add_argument("--reset", action="store_true", help="allow emptying the DigitalAirlines database of --mongo local")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--flights", type=int, default=2000)
+    parser.add_argument("--bookings", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=5000, help="number of requests to replay")
+    parser.add_argument("--sessions", type=int, default=20, help="number of logged in users that make the requests")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="json file to save the results to")
+    args = parser.parse_args()
+
+    if args.mongo == "mock":
+        import mongomock
+        pymongo.MongoClient = mongomock.MongoClient
+    elif not args.reset:
+        parser.error("--mongo local empties the DigitalAirlines database, give --reset to allow it")
+
+    import app as service
+
+    if args.mongo == "mock":
+        count_mongomock_operations(service.metrics)
+    #All the requests come from one address, so the rate limits are off unless RATE_LIMITS is set
+    os.environ.setdefault("RATE_LIMITS", json.dumps({route: None for route in service.RATE_LIMITS}))
+    flask_app = service.create_app()
+    for collection in ["Users", "Flights", "Bookings"]:
+        service.db[collection].delete_many({})
+    service.flight_cache.clear()
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    flight_ids, flights = seed(service.db, args.users, args.flights, args.bookings, rng)
+    print("Seeded %d users, %d flights and %d bookings in %.1fs" % (args.users, args.flights, args.bookings, time.perf_counter() - start))
+
+    sessions = []
+    for i in rng.sample(range(args.users), min(args.sessions, args.users)):
+        client = flask_app.test_client()
+        client.post("/login", json={"email": "user" + str(i) + "@example.com", "password": "123"})
+        sessions.append((client, "user" + str(i) + "@example.com"))
+    admin = flask_app.test_client()
+    admin.post("/login", json={"email": "np@gmail.com", "password": "admin"})
+
+    #Bookings made during the run, so they can be cancelled later
+    booked = []
+
+    def login():
+        i = rng.randrange(args.users)
+        client = flask_app.test_client()
+        return "POST /login", client.post("/login", json={"email": "user" + str(i) + "@example.com", "password": "123"})
+
+    def search():
+        client, email = rng.choice(sessions)
+        flight = rng.choice(flights)
+        kind = rng.randrange(4)
+        if kind == 0:
+            url = "/flights"
+        elif kind == 1:
+            url = "/flights?departAirport=%s&destAirport=%s" % (flight["departAirport"], flight["destAirport"])
+        elif kind == 2:
+            url = "/flights?flightDate=%s" % flight["flightDate"].strftime("%Y-%m-%d")
+        else:
+            url = "/flights?departAirport=%s&destAirport=%s&flightDate=%s" % (flight["departAirport"], flight["destAirport"], flight["flightDate"].strftime("%Y-%m-%d"))
+        return "GET /flights", client.get(url)
+
+    def flight_detail():
+        return "GET /flights/<id> (admin)", admin.get("/flights/" + rng.choice(flight_ids))
+
+    def my_bookings():
+        client, email = rng.choice(sessions)
+        return "GET /bookings", client.get("/bookings")
+
+    def book():
+        client, email = rng.choice(sessions)
+        data = {"firstName": "First", "lastName": "Last", "email": email, "passportNo": "1", "birthDate": "01-01-2002",
+                "ticketType": rng.choice(["economy", "business"])}
+        response = client.post("/bookings/new/" + rng.choice(flight_ids), json=data)
+        booked.append((client, email))
+        return "POST /bookings/new/<flight_id>", response
+
+    def cancel():
+        if not booked:
+            return book()
+        client, email = booked.pop(rng.randrange(len(booked)))
+        booking = service.db["Bookings"].find_one({"email": email}, {"_id": 1})
+        if booking == None:
+            return book()
+        return "DELETE /bookings/<id>", client.delete("/bookings/" + str(booking["_id"]))
+
+    workload = [(login, 5), (search, 45), (flight_detail, 10), (my_bookings, 15), (book, 15), (cancel, 10)]
+    if args.mongo == "mock":
+        #mongomock can't run the $lookup with a pipeline of the flight manifest, so admin flight details need --mongo local
+        workload.remove((flight_detail, 10))
+    actions = [action for action, weight in workload]
+    weights = [weight for action, weight in workload]
+
+    latencies = {}
+    operations = {}
+    errors = {}
+    start = time.perf_counter()
+    for i in range(args.requests):
+        action = rng.choices(actions, weights)[0]
+        began = time.perf_counter()
+        route, response = action()
+        response.get_data()
+        #A streamed body is recorded in the metrics of the app when it is closed
+        response.close()
+        latencies.setdefault(route, []).append(time.perf_counter() - began)
+        operations.setdefault(route, []).append(service.metrics.operations_of_request() or 0)
+        if response.status_code >= 400:
+            errors[route] = errors.get(route, 0) + 1
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route, values in sorted(latencies.items()):
+        routes[route] = {
+            "requests": len(values),
+            "errors": errors.get(route, 0),
+            "p50Ms": round(percentile(values, 50) * 1000, 3),
+            "p95Ms": round(percentile(values, 95) * 1000, 3),
+            "p99Ms": round(percentile(values, 99) * 1000, 3),
+            "requestsPerSecond": round(len(values) / sum(values), 1),
+            "dbOperationsPerRequest": round(sum(operations[route]) / len(values), 2),
+        }
+    results = {
+        "config": vars(args),
+        "requests": args.requests,
+        "seconds": round(elapsed, 3),
+        "requestsPerSecond": round(args.requests / elapsed, 1),
+        "routes": routes,
+    }
+
+    print("%-32s %8s %9s %9s %9s %9s %8s" % ("route", "requests", "p50 ms", "p95 ms", "p99 ms", "req/s", "db ops"))
+    for route, r in routes.items():
+        print("%-32s %8d %9.2f %9.2f %9.2f %9.1f %8.2f" % (route, r["requests"], r["p50Ms"], r["p95Ms"], r["p99Ms"], r["requestsPerSecond"], r["dbOperationsPerRequest"]))
+    print("Total: %d requests in %.1fs (%.1f req/s)" % (args.requests, elapsed, results["requestsPerSecond"]))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
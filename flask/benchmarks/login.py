@@ -0,0 +1,123 @@
+'''
+Benchmark of the password hashing of the service, to choose PASSWORD_HASH_COST and PASSWORD_HASH_WORKERS.
+It reports how many passwords per second are hashed at the given cost in one thread and in the pool of the hasher,
+and then the logins per second and their latency when many users log in at once, through the Flask test client
+with the database in mongomock (no network is used):
+    python benchmarks/login.py --cost 14 --workers 4 --output results.json
+'''
+import argparse, json, os, sys, threading, time
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FLASK_DIR)
+sys.path.insert(0, os.path.join(FLASK_DIR, "data"))
+
+import pymongo
+from passwords import DEFAULT_COST, Hasher, hash_password
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def hash_rate(cost, workers, count):
+    '''
+    Hashes count passwords in one thread (workers=0) or in a Hasher pool and returns the hashes per second
+    '''
+    start = time.perf_counter()
+    if workers == 0:
+        for i in range(count):
+            hash_password("password" + str(i), cost)
+    else:
+        hasher = Hasher(cost, workers, count)
+        for future in [hasher.hash("password" + str(i)) for i in range(count)]:
+            future.result()
+        hasher.pool.shutdown()
+    return count / (time.perf_counter() - start)
+
+
+def login_burst(cost, workers, users, logins, concurrency):
+    '''
+    Logs in users from many threads at once through the app and returns the latencies and the status codes
+    '''
+    import mongomock
+    pymongo.MongoClient = mongomock.MongoClient
+    os.environ["PASSWORD_HASH_COST"] = str(cost)
+    os.environ["PASSWORD_HASH_WORKERS"] = str(workers)
+    os.chdir(FLASK_DIR)
+    import app as service
+    #All the requests come from one address, so the rate limits are off unless RATE_LIMITS is set
+    os.environ.setdefault("RATE_LIMITS", json.dumps({route: None for route in service.RATE_LIMITS}))
+
+    flask_app = service.create_app()
+    service.db["Users"].delete_many({})
+    password = hash_password("123", cost)
+    service.db["Users"].insert_many([
+        {"username": "user" + str(i), "email": "user" + str(i) + "@example.com", "password": password, "type": "User"}
+        for i in range(users)
+    ])
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(logins))
+
+    def run():
+        client = flask_app.test_client()
+        for i in counter:
+            began = time.perf_counter()
+            response = client.post("/login", json={"email": "user" + str(i % users) + "@example.com", "password": "123"})
+            with lock:
+                latencies.append(time.perf_counter() - began)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the password hashing of the Digital Airlines service")
+    parser.add_argument("--cost", type=int, default=int(os.environ.get("PASSWORD_HASH_COST", DEFAULT_COST)), help="scrypt cost (2**cost rounds)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="threads of the hasher pool")
+    parser.add_argument("--hashes", type=int, default=50, help="passwords to hash in every measurement")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="threads that log in at the same time")
+    parser.add_argument("--output", help="json file to save the results to")
+    args = parser.parse_args()
+
+    single = hash_rate(args.cost, 0, args.hashes)
+    pooled = hash_rate(args.cost, args.workers, args.hashes)
+    print("cost %d: %.1f hashes/s in one thread, %.1f hashes/s with %d workers" % (args.cost, single, pooled, args.workers))
+
+    latencies, statuses, elapsed = login_burst(args.cost, args.workers, args.users, args.logins, args.concurrency)
+    results = {
+        "config": vars(args),
+        "hashesPerSecond": round(single, 1),
+        "pooledHashesPerSecond": round(pooled, 1),
+        "logins": {
+            "requests": len(latencies),
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "loginsPerSecond": round(len(latencies) / elapsed, 1),
+            "p50Ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95Ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99Ms": round(percentile(latencies, 99) * 1000, 3),
+        },
+    }
+    logins = results["logins"]
+    print("%d logins from %d threads: %.1f logins/s, p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, statuses %s" % (
+        logins["requests"], args.concurrency, logins["loginsPerSecond"], logins["p50Ms"], logins["p95Ms"], logins["p99Ms"], logins["statuses"]))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+'''
+Benchmark of the cold start of the service: the time from starting a new process until it answers its first request.
+Every start is a new Python process, so nothing is imported or cached before it. It reports the time to import app.py,
+to create the app and to answer the first request to /ready, and the whole time from starting the process:
+    python benchmarks/startup.py --starts 10 --output results.json
+By default MONGO_HOSTNAME is an address where nothing answers, to show that the service starts while MongoDB is still down
+(--mongo unreachable). --mongo mock uses mongomock and --mongo local the MongoDB of MONGO_HOSTNAME.
+With --server hypercorn or gunicorn the real server is started instead and /ready is asked over HTTP until it answers
+'''
+import argparse, json, os, subprocess, sys, time, urllib.request
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#An address of TEST-NET-3, which is never used by real hosts
+UNREACHABLE_HOST = "203.0.113.1"
+SERVERS = {
+    "hypercorn": ["hypercorn", "--bind", "127.0.0.1:{port}", "async_app:create_app()"],
+    "gunicorn": ["gunicorn", "--config", "gunicorn.conf.py", "--bind", "127.0.0.1:{port}", "app:create_app()"],
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def child(mongo):
+    '''
+    Runs in the new process: imports the app, creates it and asks /ready, and prints the times
+    '''
+    began = time.perf_counter()
+    sys.path.insert(0, FLASK_DIR)
+    if mongo == "mock":
+        import pymongo, mongomock
+        pymongo.MongoClient = mongomock.MongoClient
+    import app as service
+    imported = time.perf_counter()
+    flask_app = service.create_app()
+    created = time.perf_counter()
+    response = flask_app.test_client().get("/ready")
+    answered = time.perf_counter()
+    print(json.dumps({
+        "status": response.status_code,
+        "importMs": (imported - began) * 1000,
+        "createAppMs": (created - imported) * 1000,
+        "firstRequestMs": (answered - created) * 1000,
+        "answeredAt": time.time(),
+    }))
+
+
+def environment(mongo):
+    env = dict(os.environ)
+    if mongo == "unreachable":
+        env["MONGO_HOSTNAME"] = UNREACHABLE_HOST
+    #The background threads of the app don't add to the start, but they would wait for MongoDB with the default timeout
+    env.setdefault("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000")
+    return env
+
+
+def start_in_process(mongo):
+    started = time.time()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mongo],
+        cwd=FLASK_DIR, env=environment(mongo), capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["totalMs"] = (result.pop("answeredAt") - started) * 1000
+    return result
+
+
+def start_server(server, mongo, port, timeout):
+    '''
+    Starts the server and asks /ready every 10 ms until it answers. Returns the time from starting the process
+    '''
+    command = [part.format(port=port) for part in SERVERS[server]]
+    started = time.time()
+    process = subprocess.Popen(command, cwd=FLASK_DIR, env=environment(mongo), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.time() - started < timeout:
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:" + str(port) + "/ready", timeout=1) as response:
+                    return {"status": response.status, "totalMs": (time.time() - started) * 1000}
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(server + " did not answer in " + str(timeout) + " seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summary(values):
+    return {
+        "p50Ms": round(percentile(values, 50), 1),
+        "p95Ms": round(percentile(values, 95), 1),
+        "maxMs": round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the Digital Airlines service")
+    parser.add_argument("--mongo", choices=["unreachable", "mock", "local"], default="unreachable")
+    parser.add_argument("--server", choices=["none"] + list(SERVERS), default="none", help="start the real server instead of the app in a process")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--starts", type=int, default=10, help="number of cold starts to measure")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for a server to answer")
+    parser.add_argument("--output", help="json file to save the results to")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    runs = []
+    for i in range(args.starts):
+        if args.server == "none":
+            runs.append(start_in_process(args.mongo))
+        else:
+            runs.append(start_server(args.server, args.mongo, args.port, args.timeout))
+
+    results = {"config": vars(args), "statuses": sorted(set(run["status"] for run in runs))}
+    for measure in ["importMs", "createAppMs", "firstRequestMs", "totalMs"]:
+        if measure in runs[0]:
+            results[measure] = summary([run[measure] for run in runs])
+            print("%-15s p50 %8.1f ms   p95 %8.1f ms   max %8.1f ms" % (
+                measure, results[measure]["p50Ms"], results[measure]["p95Ms"], results[measure]["maxMs"]))
+    print("statuses", results["statuses"])
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
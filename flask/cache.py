@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import threading, time
+
+
+class LRUCache:
+    '''
+    In-process cache with a maximum number of entries and a time to live.
+    When it is full the least recently used entry is removed
+    '''
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the value stored for key, or None if there is none or it has expired
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisCache:
+    '''
+    Cache shared by all the processes of the service, stored in Redis.
+    Every key includes a generation number, so clearing the cache is a single increment
+    and the old entries expire on their own. The generation is read from Redis at most every generation_ttl seconds,
+    so most operations are a single call to Redis: the process that cleared the cache sees the new generation at once,
+    and the other processes up to generation_ttl seconds later
+    '''
+
+    def __init__(self, client, prefix="flights", ttl=60, generation_ttl=1):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.generation_ttl = generation_ttl
+        self.lock = threading.Lock()
+        self.generation = None
+        self.expires = 0
+
+    def current_generation(self):
+        with self.lock:
+            if self.generation != None and time.monotonic() < self.expires:
+                return self.generation
+        generation = int(self.client.get(self.prefix + ":generation") or 0)
+        return self.keep_generation(generation)
+
+    def keep_generation(self, generation):
+        with self.lock:
+            self.generation = generation
+            self.expires = time.monotonic() + self.generation_ttl
+            return generation
+
+    def _key(self, key):
+        return self.prefix + ":" + str(self.current_generation()) + ":" + repr(key)
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return value.decode() if value != None else None
+
+    def set(self, key, value):
+        self.client.set(self._key(key), value, ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def clear(self):
+        self.keep_generation(int(self.client.incr(self.prefix + ":generation")))
+
+
+def create_cache(url=None, maxsize=1024, ttl=60, prefix="flights"):
+    '''
+    Creates the cache given by url. Without a url the cache is kept in the process,
+    with a redis:// url it is shared through Redis under the given prefix
+    '''
+    if not url:
+        return LRUCache(maxsize, ttl)
+    import redis
+    return RedisCache(redis.Redis.from_url(url), prefix, ttl)
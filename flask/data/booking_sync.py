@@ -0,0 +1,83 @@
+from pymongo import UpdateMany
+import logging, threading, time
+
+# Every booking keeps a copy of these fields of its flight, so the bookings of a user are listed without a join.
+# When a flight changes, sync_flight_bookings() updates the copies of all its bookings with one update,
+# and reconcile_bookings() repairs any copy that was still left behind. It can also be run once from here:
+#   python booking_sync.py
+BOOKING_FLIGHT_FIELDS = ["departAirport", "destAirport", "flightDate"]
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def booking_update(flight):
+    '''
+    Returns the filter of the bookings of a flight whose copy of the flight differs from it, and their update
+    '''
+    stale = {"flightID": flight["_id"], "$or": [{field: {"$ne": flight.get(field)}} for field in BOOKING_FLIGHT_FIELDS]}
+    return stale, {"$set": {field: flight.get(field) for field in BOOKING_FLIGHT_FIELDS}}
+
+
+def sync_flight_bookings(bookings, flight):
+    '''
+    Copies the fields of a flight that was changed into all of its bookings, with a single update.
+    Returns the number of bookings that were changed
+    '''
+    stale, update = booking_update(flight)
+    return bookings.update_many(stale, update).modified_count
+
+
+def reconcile_bookings(flights, bookings, batch_size=BATCH_SIZE, pause=0):
+    '''
+    Repairs the bookings whose copy of their flight is not the same as the flight.
+    The flights are read in batches ordered by id and every batch is one bulk write, with a pause between batches
+    so the database isn't kept busy. Returns how many flights were checked and bookings were repaired
+    '''
+    report = {"flights": 0, "batches": 0, "repaired": 0}
+    query = {}
+    while True:
+        batch = list(flights.find(query, {field: 1 for field in BOOKING_FLIGHT_FIELDS}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return report
+        report["repaired"] += bookings.bulk_write([UpdateMany(*booking_update(flight)) for flight in batch], ordered=False).modified_count
+        report["flights"] += len(batch)
+        report["batches"] += 1
+        query = {"_id": {"$gt": batch[-1]["_id"]}}
+        time.sleep(pause)
+
+
+class Reconciler:
+    '''
+    Runs reconcile_bookings() in a background thread every 'interval' seconds
+    '''
+
+    def __init__(self, flights, bookings, interval=3600, batch_size=BATCH_SIZE, pause=0.1):
+        self.flights = flights
+        self.bookings = bookings
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="booking-reconciler", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                report = reconcile_bookings(self.flights, self.bookings, self.batch_size, self.pause)
+                if report["repaired"]:
+                    logger.warning("Repaired %d bookings whose flight had changed", report["repaired"])
+            except Exception:
+                logger.exception("The reconciliation of the bookings failed")
+
+
+if __name__ == "__main__":
+    from database import create_client
+
+    db = create_client()["DigitalAirlines"]
+    report = reconcile_bookings(db["Flights"], db["Bookings"])
+    print(str(report["flights"]) + " flights checked in " + str(report["batches"]) + " batches, " + str(report["repaired"]) + " bookings repaired")
@@ -0,0 +1,115 @@
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.errors import ConnectionFailure
+from pymongo.monitoring import ConnectionPoolListener
+import os, threading
+
+#Options of the MongoClient that can be set from the environment, and the type of their value.
+#Options that are not set keep the default of pymongo
+CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_READ_PREFERENCE": ("readPreference", str),
+    "MONGO_WRITE_CONCERN": ("w", lambda w: int(w) if w.isdigit() else w),
+}
+
+
+class PoolStats(ConnectionPoolListener):
+    '''
+    Counts the connections of the pool of a MongoClient
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+
+    def report(self):
+        with self.lock:
+            return {"open": self.open, "checkedOut": self.checked_out, "checkoutFailures": self.checkout_failures}
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+def client_options():
+    '''
+    Returns the options of the MongoClient that are set in the environment
+    '''
+    options = {}
+    for variable, (option, convert) in CLIENT_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = convert(value)
+    return options
+
+
+def create_client(listeners=()):
+    '''
+    Connects to our MongoDB with the options of the environment.
+    The listeners (for example PoolStats) are told about the events of the client.
+    The client connects on its first operation, so creating it never waits for MongoDB
+    '''
+    mongodb_hostname = os.environ.get("MONGO_HOSTNAME","localhost")
+    return MongoClient('mongodb://'+mongodb_hostname+':27017/', event_listeners=list(listeners), connect=False, **client_options())
+
+
+def create_async_client(listeners=()):
+    '''
+    Same as create_client, for the async driver of pymongo that the async serving mode uses
+    '''
+    mongodb_hostname = os.environ.get("MONGO_HOSTNAME","localhost")
+    return AsyncMongoClient('mongodb://'+mongodb_hostname+':27017/', event_listeners=list(listeners), **client_options())
+
+
+def supports_transactions(client):
+    '''
+    Tells if the deployment can run transactions. They need a replica set or a sharded cluster, a single mongod can't run them.
+    Returns None if MongoDB can't be reached, so it can be asked again later
+    '''
+    try:
+        hello = client.admin.command("hello")
+    except ConnectionFailure:
+        return None
+    except Exception:
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
@@ -0,0 +1,131 @@
+from pymongo.errors import BulkWriteError
+from markupsafe import escape
+from datetime import datetime
+import csv, json, time
+
+#Necessary fields to create a flight
+FLIGHT_FIELDS = [
+    "businessAvailableTickets",
+    "businessTicketCost",
+    "departAirport",
+    "destAirport",
+    "economyAvailableTickets",
+    "economyTicketCost",
+    "flightDate",
+]
+#Number of flights written with one insert_many
+BATCH_SIZE = 1000
+#Only the first errors are reported one by one, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+def parse_flight_date(value):
+    '''
+    Returns the date of a flight as a datetime at midnight, so it is stored as a date and can be compared.
+    The value is a datetime or a string like 2023-6-30 or 2023-06-30. Raises ValueError if it isn't a valid date
+    '''
+    if isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d")
+    except ValueError:
+        raise ValueError("Bad json content. The flight date must be a date like 2023-6-30")
+
+
+def parse_flight(data):
+    '''
+    Creates a flight from the given data, with the same rules as the /flights/new route.
+    Raises ValueError with the message to show if the data is not valid
+    '''
+    #A json line can be any json value, like null or a number
+    if not isinstance(data, dict):
+        raise ValueError("Bad json content. Every flight must be an object")
+    for field in FLIGHT_FIELDS:
+        if not field in data or data[field] == None:
+            raise ValueError("Information incompleted")
+    try:
+        businessTicketCost = float(data["businessTicketCost"])
+        businessAvailableTickets = int(data["businessAvailableTickets"])
+        economyTicketCost = float(data["economyTicketCost"])
+        economyAvailableTickets = int(data["economyAvailableTickets"])
+    except Exception as e:
+        raise ValueError("Bad json content. The available tickets and costs must numbers")
+    flightDate = parse_flight_date(data["flightDate"])
+
+    return {
+        "businessAvailableTickets": businessAvailableTickets,
+        "businessTicketCost": businessTicketCost,
+        "departAirport": escape(data["departAirport"]),
+        "destAirport": escape(data["destAirport"]),
+        "economyAvailableTickets": economyAvailableTickets,
+        "economyTicketCost": economyTicketCost,
+        "flightDate": flightDate,
+    }
+
+
+def read_records(lines, format):
+    '''
+    Reads the records of a file one at a time. The format is 'csv', with a header line,
+    or 'jsonl', with one json object per line. Yields the data of the record, or the exception if it can't be read
+    '''
+    if format == "csv":
+        for record in csv.DictReader(lines):
+            yield record
+    elif format == "jsonl":
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except Exception as e:
+                yield ValueError("bad json content")
+    else:
+        raise ValueError("The format must be csv or jsonl")
+
+
+def import_flights(flights, records):
+    '''
+    Validates the given records and adds them to the flights collection in unordered batches.
+    Only one batch is kept in memory at a time. Returns a report with the number of flights added,
+    the errors per row (rows start from 1) and the throughput
+    '''
+    report = {"rows": 0, "inserted": 0, "failed": 0, "errors": []}
+    start = time.perf_counter()
+
+    def error(row, message):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": row, "error": message})
+
+    def write(batch, rows):
+        if not batch:
+            return
+        try:
+            result = flights.insert_many(batch, ordered=False)
+            report["inserted"] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            report["inserted"] += e.details["nInserted"]
+            for write_error in e.details["writeErrors"]:
+                error(rows[write_error["index"]], write_error["errmsg"])
+
+    batch = []
+    rows = []
+    for record in records:
+        report["rows"] += 1
+        try:
+            if isinstance(record, Exception):
+                raise record
+            batch.append(parse_flight(record))
+            rows.append(report["rows"])
+        except ValueError as e:
+            error(report["rows"], str(e))
+        if len(batch) == BATCH_SIZE:
+            write(batch, rows)
+            batch = []
+            rows = []
+    write(batch, rows)
+
+    seconds = time.perf_counter() - start
+    report["seconds"] = round(seconds, 3)
+    report["rowsPerSecond"] = round(report["rows"] / seconds, 1) if seconds > 0 else None
+    return report
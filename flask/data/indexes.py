@@ -0,0 +1,81 @@
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+import logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+
+# Indexes of every collection. Each one matches a query done in app.py
+INDEXES = {
+    "Users": [
+        #Login and registration look users up by email, the session by username
+        {"keys": [("email", ASCENDING)], "unique": True},
+        {"keys": [("username", ASCENDING)], "unique": True},
+    ],
+    "Flights": [
+        #Search by departure and destination airport and date. Pages are ordered by id
+        {"keys": [("departAirport", ASCENDING), ("destAirport", ASCENDING), ("flightDate", ASCENDING), ("_id", ASCENDING)]},
+        #Search by departure and destination airport without the date, whose pages can't be read in id order from the index above
+        {"keys": [("departAirport", ASCENDING), ("destAirport", ASCENDING), ("_id", ASCENDING)]},
+        #Search by date only
+        {"keys": [("flightDate", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "Bookings": [
+        #Bookings of the connected user, in pages ordered by id
+        {"keys": [("email", ASCENDING), ("_id", ASCENDING)]},
+        #Bookings of a flight, and the pages of its passengers ordered by id
+        {"keys": [("flightID", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "UserDeletions": [
+        #One deletion job per user, and the workers look for the running jobs that nobody holds
+        {"keys": [("userId", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING), ("leaseUntil", ASCENDING)]},
+    ],
+}
+
+
+def create_indexes(db):
+    '''
+    Creates the indexes of the DigitalAirlines database.
+    Creating an index that already exists does nothing, so it is safe to call on every startup
+    '''
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            db[collection].create_index(index["keys"], unique=index.get("unique", False))
+
+
+class IndexBuilder:
+    '''
+    Creates the indexes in a thread, trying again every retry_interval seconds while MongoDB can't be reached,
+    so the service starts without waiting for it. 'built' is set once all the indexes exist. If MongoDB refuses an index
+    (for example a unique index over documents that repeat a value) it stops, and 'error' has the reason
+    '''
+
+    def __init__(self, db, retry_interval=5):
+        self.db = db
+        self.retry_interval = retry_interval
+        self.built = threading.Event()
+        self.error = None
+
+    def start(self):
+        threading.Thread(target=self.run, name="create-indexes", daemon=True).start()
+
+    def state(self):
+        if self.built.is_set():
+            return "built"
+        return "failed" if self.error != None else "building"
+
+    def run(self):
+        while True:
+            try:
+                create_indexes(self.db)
+                self.built.set()
+                return
+            except OperationFailure as e:
+                #Trying again would fail the same way, the documents have to be fixed first
+                self.error = str(e)
+                logger.error("The indexes could not be created: %s", e)
+                return
+            except PyMongoError as e:
+                logger.warning("The indexes could not be created, retrying in %s seconds: %s", self.retry_interval, e)
+                time.sleep(self.retry_interval)
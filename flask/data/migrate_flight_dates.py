@@ -0,0 +1,37 @@
+from pymongo import UpdateOne
+from database import create_client
+from flight_import import parse_flight_date
+from versions import FLIGHTS, VersionCounter
+
+# Converts the flight dates that are stored as strings (like "2023-6-30") into dates, in the flights and in the bookings.
+# Only dates that are still strings are converted, so it can be run again safely
+BATCH_SIZE = 1000
+
+
+if __name__ == "__main__":
+    client = create_client()
+    db = client["DigitalAirlines"]
+
+    for name in ["Flights", "Bookings"]:
+        collection = db[name]
+        converted = 0
+        failed = []
+        batch = []
+        for document in collection.find({"flightDate": {"$type": "string"}}, {"flightDate": 1}):
+            try:
+                date = parse_flight_date(document["flightDate"])
+            except ValueError:
+                failed.append(str(document["_id"]))
+                continue
+            batch.append(UpdateOne({"_id": document["_id"], "flightDate": document["flightDate"]}, {"$set": {"flightDate": date}}))
+            if len(batch) == BATCH_SIZE:
+                converted += collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            converted += collection.bulk_write(batch, ordered=False).modified_count
+        print(name + ": " + str(converted) + " dates converted")
+        if failed:
+            print(name + ": these documents have a date that is not valid and were left as they are: " + ", ".join(failed))
+
+    #The flights the service has cached have the old dates
+    VersionCounter(db["Versions"], FLIGHTS).bump()
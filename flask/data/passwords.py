@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from markupsafe import escape
+import base64, hashlib, hmac, os, secrets, threading
+
+#The cost of hashing a password is 2**cost rounds of scrypt. Every step up doubles the time and the memory of a hash
+DEFAULT_COST = 14
+#Block size and parallelism of scrypt
+BLOCK_SIZE = 8
+PARALLELISM = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+PREFIX = "scrypt"
+
+
+class HasherBusy(Exception):
+    '''
+    Raised when too many passwords are waiting to be hashed
+    '''
+
+
+def hash_password(password, cost=DEFAULT_COST):
+    '''
+    Hashes a password with scrypt and a random salt. The result has the parameters of scrypt,
+    so a password hashed with an older cost can still be checked
+    '''
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = derive(password, salt, cost, BLOCK_SIZE, PARALLELISM)
+    return "$".join([PREFIX, str(cost), str(BLOCK_SIZE), str(PARALLELISM), encode(salt), encode(key)])
+
+
+def check_password(password, stored):
+    '''
+    Checks a password against the stored one, which is a hash of hash_password()
+    or (for users created before the passwords were hashed) the password itself, escaped
+    '''
+    if not is_hashed(stored):
+        return hmac.compare_digest(str(escape(password)).encode(), str(stored).encode())
+    prefix, cost, block_size, parallelism, salt, key = stored.split("$")
+    return hmac.compare_digest(derive(password, decode(salt), int(cost), int(block_size), int(parallelism)), decode(key))
+
+
+def needs_rehash(stored, cost=DEFAULT_COST):
+    '''
+    Tells if a stored password should be hashed again: it isn't hashed yet or it was hashed with another cost
+    '''
+    if not is_hashed(stored):
+        return True
+    prefix, stored_cost, block_size, parallelism, salt, key = stored.split("$")
+    return int(stored_cost) != cost or int(block_size) != BLOCK_SIZE or int(parallelism) != PARALLELISM
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(PREFIX + "$") and stored.count("$") == 5
+
+
+def derive(password, salt, cost, block_size, parallelism):
+    n = 2 ** cost
+    #scrypt needs 128 * n * r bytes of memory, the default limit of OpenSSL is too low for high costs
+    maxmem = 128 * n * block_size * parallelism + 1024 * 1024
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=block_size, p=parallelism, maxmem=maxmem, dklen=KEY_BYTES)
+
+
+def encode(value):
+    return base64.b64encode(value).decode()
+
+
+def decode(value):
+    return base64.b64decode(value)
+
+
+class Hasher:
+    '''
+    Hashes and checks passwords in a pool with a fixed number of threads. hashlib.scrypt releases the GIL,
+    so the threads run at the same time, but never more than 'workers' of them, so a burst of logins
+    can't take all the CPU from the other routes. When 'max_waiting' passwords are already waiting, HasherBusy is raised
+    '''
+
+    def __init__(self, cost=DEFAULT_COST, workers=2, max_waiting=64):
+        self.cost = cost
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="passwords")
+        self.slots = threading.BoundedSemaphore(workers + max_waiting)
+
+    def submit(self, function, *args):
+        '''
+        Runs function in the pool and returns its future. It can be waited with result(), or awaited with asyncio.wrap_future()
+        '''
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy("Too many passwords are waiting to be checked")
+        future = self.pool.submit(function, *args)
+        future.add_done_callback(lambda future: self.slots.release())
+        return future
+
+    def hash(self, password):
+        return self.submit(hash_password, password, self.cost)
+
+    def check(self, password, stored):
+        '''
+        Checks a password in the pool. The result of the future is a pair: if the password is right,
+        and the new hash to store when the stored one must be upgraded (or None)
+        '''
+        return self.submit(self.check_and_rehash, password, stored)
+
+    def check_and_rehash(self, password, stored):
+        if not check_password(password, stored):
+            return False, None
+        if needs_rehash(stored, self.cost):
+            return True, hash_password(password, self.cost)
+        return True, None
+
+
+def create_hasher():
+    '''
+    Creates the hasher of the service with the cost and the size of the pool of the environment
+    '''
+    return Hasher(
+        int(os.environ.get("PASSWORD_HASH_COST", DEFAULT_COST)),
+        int(os.environ.get("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2))),
+        int(os.environ.get("PASSWORD_HASH_MAX_WAITING", 64)),
+    )
@@ -1,19 +1,14 @@
-from pymongo import MongoClient
 from pymongo.errors import DuplicateKeyError
 from flask import Flask, request, jsonify, redirect, Response
-import json, os
-
-# Connect to our local MongoDB
-mongodb_hostname = os.environ.get("MONGO_HOSTNAME","localhost")
-client = MongoClient('mongodb://'+mongodb_hostname+':27017/')
-
-# Choose DigitalAirlines database
-db = client["DigitalAirlines"]
-user = db["Users"]
-flights = db["Flights"]
-booking = db["Bookings"]
-
+from datetime import datetime
+import argparse, json
+from database import create_client
+from indexes import create_indexes
+from flight_import import read_records, import_flights
+from passwords import hash_password
+from versions import FLIGHTS, VersionCounter
 
+# The initial data of the service. The benchmarks in ../benchmarks use them as templates to create more
 users = [
     {
         "username": "user1",
@@ -67,8 +62,6 @@ users = [
     },
 ]
 
-user.insert_many(users)
-
 flight = {
         "businessAvailableTickets": 50,
         "businessTicketCost": 150,
@@ -76,7 +69,34 @@ flight = {
         "destAirport": "El Prat (BCN)",
         "economyAvailableTickets": 25,
         "economyTicketCost": 75,
-        "flightDate": "2023-6-30",
+        "flightDate": datetime(2023, 6, 30),
     }
 
-flights.insert_one(flight)
\ No newline at end of file
+
+if __name__ == "__main__":
+    # Connect to our local MongoDB
+    client = create_client()
+
+    # Choose DigitalAirlines database
+    db = client["DigitalAirlines"]
+    user = db["Users"]
+    flights = db["Flights"]
+    booking = db["Bookings"]
+    create_indexes(db)
+
+    parser = argparse.ArgumentParser(description="Adds the initial users and flight to the database, or imports the flights of a schedule file")
+    parser.add_argument("--flights", help="csv or json lines file with the flights to import")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="format of the file. By default it is found from the file extension")
+    args = parser.parse_args()
+
+    if args.flights:
+        format = args.format or ("csv" if args.flights.endswith(".csv") else "jsonl")
+        with open(args.flights, encoding="utf-8", newline="") as file:
+            report = import_flights(flights, read_records(file, format))
+        print(json.dumps(report, indent=4))
+    else:
+        #Only the hashes of the passwords are stored
+        user.insert_many([dict(u, password=hash_password(u["password"])) for u in users])
+        flights.insert_one(flight)
+    #The service sends the flights again instead of the copies it has cached
+    VersionCounter(db["Versions"], FLIGHTS).bump()
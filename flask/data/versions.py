@@ -0,0 +1,54 @@
+from pymongo import ReturnDocument
+import threading, time
+
+#Name of the version of the flights, that goes up every time a flight is created, changed or deleted
+FLIGHTS = "flights"
+
+
+class VersionCounter:
+    '''
+    A number kept in MongoDB (in the Versions collection) that goes up with every change of a collection,
+    so a copy made at one version is valid for as long as the version stays the same. It is persisted, so it never
+    goes back when the service restarts. The version is read from MongoDB at most every 'ttl' seconds:
+    the process that made a change knows its new version at once, and the other processes up to ttl seconds later
+    '''
+
+    def __init__(self, versions, name, ttl=1):
+        self.versions = versions
+        self.name = name
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.value = None
+        self.expires = 0
+
+    def current(self):
+        '''
+        Returns the version if it was read in the last ttl seconds, otherwise None
+        '''
+        with self.lock:
+            if self.value != None and time.monotonic() < self.expires:
+                return self.value
+        return None
+
+    def load(self, document):
+        '''
+        Keeps the version of the document read from the Versions collection and returns it
+        '''
+        with self.lock:
+            self.value = document["version"] if document != None else 0
+            self.expires = time.monotonic() + self.ttl
+            return self.value
+
+    def get(self):
+        version = self.current()
+        if version == None:
+            version = self.load(self.versions.find_one({"_id": self.name}))
+        return version
+
+    def bump(self):
+        '''
+        Increases the version after a change and returns the new one
+        '''
+        return self.load(self.versions.find_one_and_update(
+            {"_id": self.name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+        ))
@@ -0,0 +1,174 @@
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta, timezone
+import logging, threading
+
+logger = logging.getLogger(__name__)
+
+#What is shown of a deletion job
+JOB_FIELDS = {"status": 1, "bookingsDeleted": 1, "seatsReleased": 1, "created": 1, "finished": 1}
+
+
+class UserDeletions:
+    '''
+    Deletes users together with their bookings, in the background. Every deletion is a job in the jobs collection:
+    the user is marked as deleting (so they can't log in anymore), and a thread of every worker deletes their bookings
+    in batches and gives the seats back to the flights, with one update per flight for the whole batch.
+    The user is deleted after their last booking. A job is taken by one worker at a time for 'lease' seconds,
+    and a job left unfinished (because the worker crashed or was restarted) is taken again and continues
+    where it stopped, so every step can be repeated without releasing a seat twice
+    '''
+
+    def __init__(self, users, bookings, flights, jobs, batch_size=500, lease=60, poll_interval=30):
+        self.users = users
+        self.bookings = bookings
+        self.flights = flights
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease)
+        self.poll_interval = poll_interval
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="user-deletions", daemon=True)
+        self.thread.start()
+
+    def request(self, user):
+        '''
+        Marks the user as deleting and creates the job that deletes them. If the user is already being deleted,
+        their job is returned
+        '''
+        self.users.update_one({"_id": user["_id"]}, {"$set": {"status": "deleting"}})
+        now = datetime.now(timezone.utc)
+        try:
+            job = self.jobs.find_one_and_update(
+                {"userId": user["_id"]},
+                {"$setOnInsert": {
+                    "userId": user["_id"],
+                    "email": user["email"],
+                    "status": "running",
+                    "bookingsDeleted": 0,
+                    "seatsReleased": 0,
+                    "created": now,
+                    "leaseUntil": now,
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            #Created by another request at the same time
+            job = self.jobs.find_one({"userId": user["_id"]})
+        self.wake.set()
+        return job
+
+    def status(self, job_id):
+        '''
+        Returns the progress of a job, or None if there is no such job
+        '''
+        return self.jobs.find_one({"_id": job_id}, JOB_FIELDS)
+
+    def run(self):
+        while True:
+            try:
+                job = self.claim()
+                while job != None:
+                    self.process(job)
+                    job = self.claim()
+            except Exception:
+                #The job is taken again when its lease ends
+                logger.exception("A user deletion failed, retrying")
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+
+    def claim(self):
+        '''
+        Takes a running job that no other worker holds
+        '''
+        now = datetime.now(timezone.utc)
+        return self.jobs.find_one_and_update(
+            {"status": "running", "leaseUntil": {"$lte": now}},
+            {"$set": {"owner": ObjectId(), "leaseUntil": now + self.lease}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def process(self, job):
+        '''
+        Deletes the bookings of the user of a job batch by batch, and then the user
+        '''
+        while True:
+            if job.get("done") != None:
+                self.clean(job["done"])
+            batch = job.get("batch")
+            if batch == None:
+                batch = self.next_batch(job["email"])
+                if batch == None:
+                    break
+                #The batch is saved before anything is deleted, so it can be finished if the worker stops
+                job = self.jobs.find_one_and_update(
+                    {"_id": job["_id"], "owner": job["owner"]},
+                    {"$set": {"batch": batch, "leaseUntil": datetime.now(timezone.utc) + self.lease}},
+                    return_document=ReturnDocument.AFTER,
+                )
+                if job == None:
+                    #The lease ended and another worker took the job
+                    return
+            self.apply(batch)
+            #The ids of the batch are removed from the flights only after the job has the batch as done
+            job = self.jobs.find_one_and_update(
+                {"_id": job["_id"], "owner": job["owner"], "batch.id": batch["id"]},
+                {
+                    "$unset": {"batch": ""},
+                    "$inc": {"bookingsDeleted": len(batch["bookings"]), "seatsReleased": sum(sum(flight["seats"].values()) for flight in batch["flights"])},
+                    "$set": {"done": {"id": batch["id"], "flightIDs": [flight["flightID"] for flight in batch["flights"]]}, "leaseUntil": datetime.now(timezone.utc) + self.lease},
+                },
+                return_document=ReturnDocument.AFTER,
+            )
+            if job == None:
+                return
+
+        self.users.delete_one({"_id": job["userId"], "status": "deleting"})
+        self.jobs.update_one(
+            {"_id": job["_id"], "owner": job["owner"]},
+            {"$set": {"status": "done", "finished": datetime.now(timezone.utc)}, "$unset": {"leaseUntil": "", "owner": ""}},
+        )
+
+    def next_batch(self, email):
+        '''
+        Returns the next bookings to delete and the seats to give back to every flight, or None if there are none left
+        '''
+        found = list(self.bookings.find({"email": email}, {"flightID": 1, "ticketType": 1}).sort("_id", 1).limit(self.batch_size))
+        if not found:
+            return None
+        seats = {}
+        for booking in found:
+            flight = seats.setdefault(booking["flightID"], {})
+            field = booking["ticketType"] + "AvailableTickets"
+            flight[field] = flight.get(field, 0) + 1
+        return {
+            "id": ObjectId(),
+            "bookings": [booking["_id"] for booking in found],
+            "flights": [{"flightID": flight_id, "seats": flight} for flight_id, flight in seats.items()],
+        }
+
+    def apply(self, batch):
+        '''
+        Deletes the bookings of a batch and gives their seats back. Every flight keeps the ids of the batches
+        it got seats from until the batch is done, so a batch that is applied again doesn't release them twice
+        '''
+        self.bookings.delete_many({"_id": {"$in": batch["bookings"]}})
+        self.flights.bulk_write([
+            UpdateOne(
+                {"_id": flight["flightID"], "seatReleases": {"$ne": batch["id"]}},
+                {"$inc": flight["seats"], "$push": {"seatReleases": batch["id"]}},
+            )
+            for flight in batch["flights"]
+        ], ordered=False)
+
+    def clean(self, done):
+        '''
+        Removes the id of a batch that is done from its flights
+        '''
+        self.flights.update_many({"_id": {"$in": done["flightIDs"]}}, {"$pull": {"seatReleases": done["id"]}})
+        self.flights.update_many({"_id": {"$in": done["flightIDs"]}, "seatReleases": {"$size": 0}}, {"$unset": {"seatReleases": ""}})
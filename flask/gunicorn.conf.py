@@ -0,0 +1,19 @@
+# Configuration of gunicorn for the production mode (SERVER_MODE=production).
+# Every worker is a separate process that creates the app, and so its own MongoClient, after it starts
+import multiprocessing, os
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "5000")
+#By default two workers per CPU core plus one. The sessions are kept in the worker that created them
+#unless SESSION_STORE_URL gives a store shared by all the workers (the Redis of docker-compose.yml), so without it there is only one worker
+if os.environ.get("SESSION_STORE_URL"):
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+else:
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+#Threads per worker. The routes mostly wait for MongoDB, so threads let a worker serve other requests meanwhile.
+#Every open seats stream holds a thread, so the worker also has one for each of the MAX_SEAT_STREAMS of app.py
+threads = int(os.environ.get("GUNICORN_THREADS", 4)) + int(os.environ.get("MAX_SEAT_STREAMS", 50))
+worker_class = "gthread"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+#The app must not be loaded before the workers are forked
+preload_app = False
+accesslog = "-"
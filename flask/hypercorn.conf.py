@@ -0,0 +1,15 @@
+# Configuration of hypercorn for the async mode (SERVER_MODE=async).
+# Every worker is a separate process with its own event loop, which creates the app and its MongoClients after it starts
+import multiprocessing, os
+
+bind = ["0.0.0.0:" + os.environ.get("PORT", "5000")]
+#One event loop serves many requests at once, so one worker per CPU core is enough. As with gunicorn
+#the sessions are kept in the worker that created them unless SESSION_STORE_URL is set (as in docker-compose.yml), so without it there is only one worker
+if os.environ.get("SESSION_STORE_URL"):
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+else:
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+#Connections that stay open between requests
+keep_alive_timeout = int(os.environ.get("KEEP_ALIVE_TIMEOUT", 5))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+accesslog = "-"
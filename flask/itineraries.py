@@ -0,0 +1,188 @@
+from datetime import timedelta
+from flight_import import parse_flight_date
+import threading, time
+
+#Fields of a flight that the route network needs
+ROUTE_FIELDS = {"departAirport": 1, "destAirport": 1, "flightDate": 1, "economyTicketCost": 1, "businessTicketCost": 1}
+
+
+def parse_date(value):
+    '''
+    Returns the date of a flight, stored as a date or (before the migration) as a string like 2023-6-30.
+    Returns None if it isn't a valid date
+    '''
+    try:
+        return parse_flight_date(value).date()
+    except ValueError:
+        return None
+
+
+class RouteIndex:
+    '''
+    The network of flights kept in memory, so connections are found without a query per leg.
+    Flights are indexed by departure airport and date, and then by destination airport.
+    The flights only have a date, so the connection rules are in days: a connecting flight leaves
+    between min_connection_days and max_connection_days after the previous one.
+    The index is updated with add() and remove() when a flight changes in this process,
+    and reloaded completely every ttl seconds to see the changes of other processes.
+    Only one thread reloads it at a time, and the others keep searching the old index meanwhile.
+    The flights added or removed during a reload may be missing from what it read, so they are applied again to the new index
+    '''
+
+    def __init__(self, min_connection_days=0, max_connection_days=1, ttl=60):
+        self.min_connection = timedelta(days=min_connection_days)
+        self.max_connection = timedelta(days=max_connection_days)
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.reloaded = threading.Condition(self.lock)
+        self.departures = {}
+        self.legs = {}
+        self.loaded = None
+        #If the index was ever loaded, so there is one to search during a reload
+        self.ready = False
+        self.loading = False
+        #The changes made while the index is reloaded, or None when it isn't
+        self.changes = None
+        self.invalidated = False
+
+    def invalidate(self):
+        '''
+        Makes the next search reload the whole index
+        '''
+        with self.lock:
+            self.loaded = None
+            #A reload that is running may have read the flights before the change
+            self.invalidated = self.loading
+
+    def load(self, flights):
+        '''
+        Builds the index from all the flights of the collection
+        '''
+        departures = {}
+        legs = {}
+        try:
+            for flight in flights.find({}, ROUTE_FIELDS):
+                leg = self.make_leg(flight)
+                if leg != None:
+                    legs[leg["_id"]] = leg
+                    departures.setdefault((leg["departAirport"], leg["date"]), {}).setdefault(leg["destAirport"], []).append(leg)
+            with self.lock:
+                self.departures = departures
+                self.legs = legs
+                changes, self.changes = self.changes, None
+                for change, value in changes or []:
+                    if change == "add":
+                        self.add(value)
+                    else:
+                        self.remove(value)
+                self.loaded = None if self.invalidated else time.monotonic()
+                self.ready = True
+        finally:
+            with self.lock:
+                self.loading = False
+                self.changes = None
+                self.invalidated = False
+                self.reloaded.notify_all()
+
+    def ensure_loaded(self, flights):
+        '''
+        Reloads the index if it is older than ttl seconds, unless another thread is already reloading it.
+        Only the first load is waited for, since there is no index to search before it
+        '''
+        with self.lock:
+            while True:
+                if self.loaded != None and time.monotonic() - self.loaded < self.ttl:
+                    return
+                if not self.loading:
+                    break
+                if self.ready:
+                    return
+                self.reloaded.wait()
+            self.loading = True
+            self.changes = []
+        self.load(flights)
+
+    def make_leg(self, flight):
+        date = parse_date(flight.get("flightDate"))
+        if date == None:
+            return None
+        return {
+            "_id": str(flight["_id"]),
+            "departAirport": str(flight["departAirport"]),
+            "destAirport": str(flight["destAirport"]),
+            "flightDate": date.isoformat(),
+            "date": date,
+            "economy": flight.get("economyTicketCost"),
+            "business": flight.get("businessTicketCost"),
+        }
+
+    def add(self, flight):
+        '''
+        Adds a new flight to the index, or replaces it if it was changed
+        '''
+        leg = self.make_leg(flight)
+        with self.lock:
+            self.remove(str(flight["_id"]))
+            #After the removal, which is also recorded, so they are applied again in the same order
+            if self.changes != None:
+                self.changes.append(("add", flight))
+            if leg != None:
+                self.legs[leg["_id"]] = leg
+                self.departures.setdefault((leg["departAirport"], leg["date"]), {}).setdefault(leg["destAirport"], []).append(leg)
+
+    def remove(self, flight_id):
+        with self.lock:
+            if self.changes != None:
+                self.changes.append(("remove", flight_id))
+            leg = self.legs.pop(str(flight_id), None)
+            if leg != None:
+                self.departures[(leg["departAirport"], leg["date"])][leg["destAirport"]].remove(leg)
+
+    def leaving(self, airport, date):
+        '''
+        Returns the flights that leave the airport on a connection window after date, by destination
+        '''
+        day = date + self.min_connection
+        while day <= date + self.max_connection:
+            yield self.departures.get((airport, day), {})
+            day += timedelta(days=1)
+
+    def search(self, origin, destination, date, max_stops=2, ticket_type="economy", limit=20):
+        '''
+        Finds the itineraries from origin to destination that start on date, with up to max_stops connections,
+        that never pass through the same airport twice. Returns the cheapest ones first
+        '''
+        itineraries = []
+        with self.lock:
+            first = self.departures.get((origin, date), {})
+            for leg in first.get(destination, []):
+                itineraries.append([leg])
+            if max_stops >= 1:
+                for stop, legs in first.items():
+                    if stop == destination or stop == origin:
+                        continue
+                    for leg in legs:
+                        for second in self.leaving(stop, leg["date"]):
+                            for leg2 in second.get(destination, []):
+                                itineraries.append([leg, leg2])
+                            if max_stops >= 2:
+                                for stop2, legs2 in second.items():
+                                    if stop2 in (origin, destination, stop):
+                                        continue
+                                    for leg2 in legs2:
+                                        for third in self.leaving(stop2, leg2["date"]):
+                                            for leg3 in third.get(destination, []):
+                                                itineraries.append([leg, leg2, leg3])
+
+        output = []
+        for legs in itineraries:
+            costs = [leg[ticket_type] for leg in legs]
+            if None in costs:
+                continue
+            output.append({
+                "legs": [{k: leg[k] for k in ("_id", "departAirport", "destAirport", "flightDate")} for leg in legs],
+                "stops": len(legs) - 1,
+                "price": sum(costs),
+            })
+        output.sort(key=lambda itinerary: (itinerary["price"], itinerary["stops"]))
+        return output[:limit]
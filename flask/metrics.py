@@ -0,0 +1,166 @@
+from pymongo.monitoring import CommandListener
+from collections import defaultdict
+import contextvars, logging, threading
+
+logger = logging.getLogger(__name__)
+
+#Upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+#Upper bounds of the buckets of the histogram of database operations per request
+OPERATION_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 50)
+
+
+def opens_awaiting_cursor(command_name, command):
+    '''
+    Tells if a command opens a cursor whose getMore waits on the server until there is new data:
+    a change stream, or a tailable cursor with awaitData
+    '''
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline", [])
+        return len(pipeline) > 0 and "$changeStream" in pipeline[0]
+    return command_name == "find" and command.get("tailable", False) and command.get("awaitData", False)
+
+
+class Histogram:
+    '''
+    Counts observed values in buckets, like a Prometheus histogram
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        '''
+        Returns the lines of the histogram in the Prometheus text format
+        '''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append("%s_bucket{%s,le=\"%s\"} %d" % (name, labels, bound, cumulative))
+        lines.append("%s_bucket{%s,le=\"+Inf\"} %d" % (name, labels, self.count))
+        lines.append("%s_sum{%s} %f" % (name, labels, self.sum))
+        lines.append("%s_count{%s} %d" % (name, labels, self.count))
+        return lines
+
+
+class Metrics(CommandListener):
+    '''
+    Collects the latency of every route and the operations done on MongoDB.
+    It is registered as a command listener of the MongoClient, so it sees every command sent to the database.
+    The commands are also counted per request, as pymongo runs the listener in the thread (or, with the async driver,
+    the task) that sent the command. The count is kept in a context variable, which is separate for every thread and
+    every task of the event loop, and is shared with the threads that a task starts with asyncio.to_thread
+    '''
+
+    def __init__(self, slow_query_ms=100):
+        self.slow_query_ms = slow_query_ms
+        self.lock = threading.Lock()
+        self.request_operations = contextvars.ContextVar("request_operations", default=None)
+        self.requests = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.operations = defaultdict(lambda: Histogram(OPERATION_BUCKETS))
+        self.commands = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.failures = defaultdict(int)
+        self.collections = {}
+        #Ids of the open cursors of change streams and tailable cursors, whose getMore waits for new data
+        self.awaiting = set()
+
+    def start_request(self):
+        #A list, so the threads started from the context of the request add to the same count
+        self.request_operations.set([0])
+
+    def count_operation(self):
+        operations = self.request_operations.get()
+        if operations != None:
+            operations[0] += 1
+
+    def operations_of_request(self):
+        '''
+        Returns the operations done by the current request so far, or None outside of a request
+        '''
+        operations = self.request_operations.get()
+        return operations[0] if operations != None else None
+
+    def end_request(self, route, method, status, seconds):
+        operations = self.operations_of_request()
+        with self.lock:
+            self.requests[(route, method, status)].observe(seconds)
+            if operations != None:
+                self.operations[(route, method)].observe(operations)
+
+    def started(self, event):
+        #The collection is only in the command that starts the operation, so it is kept until the operation ends
+        command = event.command
+        collection = command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        with self.lock:
+            if event.command_name == "killCursors":
+                self.awaiting.difference_update(command.get("cursors", []))
+            #The id of the cursor when this is a getMore that waits for new data
+            awaited = command["getMore"] if event.command_name == "getMore" and command["getMore"] in self.awaiting else None
+            self.collections[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else "",
+                opens_awaiting_cursor(event.command_name, command),
+                awaited,
+            )
+        self.count_operation()
+
+    def succeeded(self, event):
+        self.finished(event, False)
+
+    def failed(self, event):
+        self.finished(event, True)
+
+    def finished(self, event, failed):
+        seconds = event.duration_micros / 1000000
+        with self.lock:
+            collection, opens, awaited = self.collections.pop((event.connection_id, event.request_id), ("", False, None))
+            self.commands[(event.database_name, collection, event.command_name)].observe(seconds)
+            if failed:
+                self.failures[(event.database_name, collection, event.command_name)] += 1
+            if opens or awaited != None:
+                #The cursor is closed when its id in the reply is 0
+                cursor_id = 0 if failed else event.reply.get("cursor", {}).get("id", 0)
+                if opens and cursor_id:
+                    self.awaiting.add(cursor_id)
+                elif awaited != None and not cursor_id:
+                    self.awaiting.discard(awaited)
+        #A getMore of a change stream or tailable cursor waits for new data on purpose, so it isn't slow
+        if awaited == None and seconds * 1000 >= self.slow_query_ms:
+            logger.warning("Slow MongoDB %s on %s.%s took %.1f ms", event.command_name, event.database_name, collection, seconds * 1000)
+
+    def render(self):
+        '''
+        Returns all the metrics in the Prometheus text format
+        '''
+        lines = []
+        with self.lock:
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for (route, method, status), histogram in sorted(self.requests.items()):
+                labels = 'route="%s",method="%s",status="%s"' % (route, method, status)
+                lines.extend(histogram.lines("http_request_duration_seconds", labels))
+            lines.append("# TYPE http_request_db_operations histogram")
+            for (route, method), histogram in sorted(self.operations.items()):
+                labels = 'route="%s",method="%s"' % (route, method)
+                lines.extend(histogram.lines("http_request_db_operations", labels))
+            lines.append("# TYPE mongo_command_duration_seconds histogram")
+            for (database, collection, command), histogram in sorted(self.commands.items()):
+                labels = 'database="%s",collection="%s",command="%s"' % (database, collection, command)
+                lines.extend(histogram.lines("mongo_command_duration_seconds", labels))
+            lines.append("# TYPE mongo_command_failures_total counter")
+            for (database, collection, command), count in sorted(self.failures.items()):
+                labels = 'database="%s",collection="%s",command="%s"' % (database, collection, command)
+                lines.append("mongo_command_failures_total{%s} %d" % (labels, count))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,175 @@
+from pymongo.monitoring import CommandListener
+from collections import OrderedDict
+import contextvars, math, threading, time
+
+
+class MemoryBuckets:
+    '''
+    Token buckets kept in the process. Every bucket holds up to 'burst' tokens and gets 'rate' tokens per second.
+    At most maxsize buckets are kept, the least recently used are removed first (they are usually full anyway)
+    '''
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        '''
+        Takes a token from the bucket of key. Returns 0 if there was one, otherwise the seconds until there is one
+        '''
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class RedisBuckets:
+    '''
+    Token buckets shared by all the processes of the service, stored in Redis.
+    A token is taken with a script, so the check and the update are atomic
+    '''
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'time')
+    local tokens = tonumber(state[1]) or burst
+    local last = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'time', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, client, prefix="ratelimit"):
+        self.prefix = prefix
+        self.script = client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst):
+        return float(self.script(keys=[self.prefix + ":" + key], args=[rate, burst]))
+
+
+def create_buckets(url=None, maxsize=100000):
+    '''
+    Creates the store of the token buckets. Without a url it is kept in the process,
+    with a redis:// url it is shared through Redis
+    '''
+    if not url:
+        return MemoryBuckets(maxsize)
+    import redis
+    return RedisBuckets(redis.Redis.from_url(url))
+
+
+class RateLimiter:
+    '''
+    Limits the requests of every client to a route with token buckets. limits has the requests per second
+    and the burst of every limited route. A client is its IP address and, when logged in, its user,
+    and a request is allowed only if both of them have a token left
+    '''
+
+    def __init__(self, buckets, limits):
+        self.buckets = buckets
+        self.limits = limits
+
+    def check(self, route, ip, user=None):
+        '''
+        Returns 0 if the request is allowed, otherwise the seconds until the client can try again
+        '''
+        limit = self.limits.get(route)
+        if limit == None:
+            return 0
+        rate, burst = limit
+        wait = self.buckets.take(route + ":ip:" + str(ip), rate, burst)
+        if user != None:
+            wait = max(wait, self.buckets.take(route + ":user:" + user, rate, burst))
+        return wait
+
+
+class AdmissionGate(CommandListener):
+    '''
+    Sheds load before it reaches the database. A request is refused when max_in_flight requests are already
+    being served by the process, or when the recent latency of the MongoDB commands is over max_db_latency_ms.
+    It is a command listener of the MongoClient, but it only measures the commands of the requests it admitted
+    (in their thread, or their task in async mode), not those of the background threads like the change stream
+    of the seats, or of requests admitted with measured=False like the reports, whose long aggregations are expected.
+    The latency is averaged over the last commands and fades while no commands run, so the gate opens again
+    once the database recovers even if all the requests were refused in the meantime
+    '''
+
+    def __init__(self, max_in_flight=256, max_db_latency_ms=1000, retry_after=1, half_life=1.0):
+        self.max_in_flight = max_in_flight
+        self.max_db_latency_ms = max_db_latency_ms
+        self.retry_after = retry_after
+        self.half_life = half_life
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.latency_ms = 0.0
+        self.measured = time.monotonic()
+        self.measuring = contextvars.ContextVar("measuring", default=False)
+
+    def db_latency_ms(self):
+        with self.lock:
+            return self.latency_ms * 0.5 ** ((time.monotonic() - self.measured) / self.half_life)
+
+    def enter(self, measured=True):
+        '''
+        Admits a request. Returns None if it is admitted, otherwise the reason it was refused.
+        Every admitted request must call leave() when it ends. With measured=False its commands don't count for the latency
+        '''
+        if self.max_db_latency_ms and self.db_latency_ms() > self.max_db_latency_ms:
+            return "The database is overloaded, please try again later"
+        with self.lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                return "The service is overloaded, please try again later"
+            self.in_flight += 1
+        self.measuring.set(measured)
+        return None
+
+    def leave(self):
+        self.measuring.set(False)
+        with self.lock:
+            self.in_flight -= 1
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if self.measuring.get():
+            self.observe(event.duration_micros / 1000)
+
+    def failed(self, event):
+        if self.measuring.get():
+            self.observe(event.duration_micros / 1000)
+
+    def observe(self, milliseconds):
+        with self.lock:
+            now = time.monotonic()
+            faded = self.latency_ms * 0.5 ** ((now - self.measured) / self.half_life)
+            self.latency_ms = 0.8 * faded + 0.2 * milliseconds
+            self.measured = now
+
+
+def retry_after_seconds(wait):
+    '''
+    The value of the Retry-After header, in whole seconds
+    '''
+    return str(max(1, math.ceil(wait)))
@@ -0,0 +1,157 @@
+from pymongo.read_preferences import SecondaryPreferred
+import csv, io, json
+
+#Columns of the exports, in order
+BOOKING_COLUMNS = [
+    "_id", "flightID", "departAirport", "destAirport", "flightDate", "ticketType",
+    "email", "firstName", "lastName", "passportNo", "birthDate",
+]
+FLIGHT_COLUMNS = [
+    "_id", "departAirport", "destAirport", "flightDate",
+    "economySold", "economySeats", "businessSold", "businessSeats", "loadFactor",
+    "economyRevenue", "businessRevenue", "revenue",
+]
+ROUTE_COLUMNS = ["departAirport", "destAirport", "flights", "soldSeats", "seats", "loadFactor", "revenue"]
+DATE_COLUMNS = ["flightDate", "flights", "soldSeats", "seats", "loadFactor", "revenue"]
+#How the load factors can be grouped, and their columns
+LOAD_FACTOR_GROUPS = {"flight": FLIGHT_COLUMNS, "route": ROUTE_COLUMNS, "date": DATE_COLUMNS}
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+#The rows are sent in chunks of about this many bytes
+CHUNK_SIZE = 64 * 1024
+#Spreadsheets run cells that start with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def for_reports(collection):
+    '''
+    Returns the collection reading from a secondary of the replica set when there is one, so the exports don't load the primary.
+    Without secondaries (or a single mongod) it reads from the primary
+    '''
+    return collection.with_options(read_preference=SecondaryPreferred())
+
+
+def date_filter(start, end):
+    '''
+    Returns the query of the flight dates from start to end (both included), either can be None
+    '''
+    dates = {}
+    if start is not None:
+        dates["$gte"] = start
+    if end is not None:
+        dates["$lte"] = end
+    return {"flightDate": dates} if dates else {}
+
+
+def ratio(part, whole):
+    return {"$cond": [{"$gt": [whole, 0]}, {"$divide": [part, whole]}, 0]}
+
+
+def load_factor_pipeline(group, start=None, end=None):
+    '''
+    Returns the aggregation on the flights of the seats sold, the load factor and the revenue of every flight,
+    or of every route or date when group is "route" or "date". A flight has its available seats,
+    so its seats are the available plus the sold ones. The revenue uses the current ticket costs.
+    The bookings of every flight are only counted by ticket type in the join, and the flights are sorted by id
+    before it, so the rows of the flights are sent as they are computed instead of after all of them
+    '''
+    def sold(ticket_type):
+        return {"$sum": {"$map": {
+            "input": {"$filter": {"input": "$sold", "as": "s", "cond": {"$eq": ["$$s._id", ticket_type]}}},
+            "as": "s",
+            "in": "$$s.count",
+        }}}
+
+    pipeline = [{"$match": date_filter(start, end)}]
+    if group == "flight":
+        pipeline.append({"$sort": {"_id": 1}})
+    pipeline += [
+        {"$lookup": {
+            "from": "Bookings",
+            "localField": "_id",
+            "foreignField": "flightID",
+            "pipeline": [{"$group": {"_id": "$ticketType", "count": {"$sum": 1}}}],
+            "as": "sold",
+        }},
+        {"$project": {
+            "departAirport": 1,
+            "destAirport": 1,
+            "flightDate": 1,
+            "economyAvailableTickets": 1,
+            "businessAvailableTickets": 1,
+            "economyTicketCost": 1,
+            "businessTicketCost": 1,
+            "economySold": sold("economy"),
+            "businessSold": sold("business"),
+        }},
+        {"$project": {
+            "departAirport": 1,
+            "destAirport": 1,
+            "flightDate": 1,
+            "economySold": 1,
+            "businessSold": 1,
+            "economySeats": {"$add": ["$economySold", "$economyAvailableTickets"]},
+            "businessSeats": {"$add": ["$businessSold", "$businessAvailableTickets"]},
+            "economyRevenue": {"$multiply": ["$economySold", "$economyTicketCost"]},
+            "businessRevenue": {"$multiply": ["$businessSold", "$businessTicketCost"]},
+        }},
+    ]
+    if group == "flight":
+        return pipeline + [
+            {"$addFields": {
+                "loadFactor": ratio({"$add": ["$economySold", "$businessSold"]}, {"$add": ["$economySeats", "$businessSeats"]}),
+                "revenue": {"$add": ["$economyRevenue", "$businessRevenue"]},
+            }},
+        ]
+
+    keys = {"route": {"departAirport": "$departAirport", "destAirport": "$destAirport"}, "date": {"flightDate": "$flightDate"}}[group]
+    return pipeline + [
+        {"$group": {
+            "_id": keys,
+            "flights": {"$sum": 1},
+            "soldSeats": {"$sum": {"$add": ["$economySold", "$businessSold"]}},
+            "seats": {"$sum": {"$add": ["$economySeats", "$businessSeats"]}},
+            "revenue": {"$sum": {"$add": ["$economyRevenue", "$businessRevenue"]}},
+        }},
+        {"$addFields": {"loadFactor": ratio("$soldSeats", "$seats")}},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def group_rows(rows):
+    '''
+    Moves the fields of the grouped rows out of their _id
+    '''
+    for row in rows:
+        key = row.pop("_id")
+        yield dict(key, **row)
+
+
+def export(rows, columns, format, default):
+    '''
+    Writes the rows as csv (with a header) or as json lines, a chunk at a time, so the memory used
+    doesn't grow with the number of rows. default converts the values that aren't strings or numbers
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(columns)
+    for row in rows:
+        if format == "csv":
+            writer.writerow([csv_value(row.get(column), default) for column in columns])
+        else:
+            buffer.write(json.dumps({column: row.get(column) for column in columns}, default=default, separators=(",", ":")) + "\n")
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_value(value, default):
+    if value is None:
+        return ""
+    if not isinstance(value, (str, int, float)):
+        value = default(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
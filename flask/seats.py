@@ -0,0 +1,146 @@
+from pymongo.errors import OperationFailure
+from bson.objectid import ObjectId
+import logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+#The fields of a flight that are sent to the subscribers
+SEAT_FIELDS = {"economyAvailableTickets": 1, "businessAvailableTickets": 1}
+#Error of MongoDB when change streams are used on a single mongod
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+
+
+class Subscriber:
+    '''
+    Receives the seat changes of some flights. Only the latest seats of every flight are kept until they are taken,
+    so a slow subscriber never holds more than one change per flight. notify is called (from the thread of the feed)
+    every time something new arrives
+    '''
+
+    def __init__(self, flight_ids, notify):
+        self.flight_ids = flight_ids
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def put(self, flight_id, seats):
+        with self.lock:
+            if seats == None:
+                self.pending[flight_id] = None
+            elif self.pending.get(flight_id, {}) != None:
+                self.pending[flight_id] = dict(self.pending.get(flight_id, {}), **seats)
+        self.notify()
+
+    def take(self):
+        '''
+        Returns the changes that arrived since the last call, by flight id. None means that the flight was deleted
+        '''
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        return pending
+
+
+class SeatFeed:
+    '''
+    Sends the changes of the available seats of the flights to the subscribers, in memory.
+    One thread per process watches the flights: with a change stream when MongoDB runs as a replica set,
+    otherwise (a single mongod, for example for local testing) by reading the seats of the subscribed flights
+    every poll_interval seconds with one query. The thread starts with the first subscriber.
+    change_stream can also be a function that tells if change streams can be used, asked when the thread starts
+    '''
+
+    def __init__(self, flights, change_stream=True, poll_interval=1.0):
+        self.flights = flights
+        self.change_stream = change_stream
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.thread = None
+        self.resume_token = None
+
+    def subscribe(self, flight_ids, notify):
+        subscriber = Subscriber(flight_ids, notify)
+        with self.lock:
+            for flight_id in flight_ids:
+                self.subscribers.setdefault(flight_id, set()).add(subscriber)
+            if self.thread == None:
+                self.thread = threading.Thread(target=self.run, name="seat-feed", daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            for flight_id in subscriber.flight_ids:
+                subscribers = self.subscribers.get(flight_id, set())
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    self.subscribers.pop(flight_id, None)
+
+    def publish(self, flight_id, seats):
+        with self.lock:
+            subscribers = list(self.subscribers.get(flight_id, ()))
+        for subscriber in subscribers:
+            subscriber.put(flight_id, seats)
+
+    def run(self):
+        if callable(self.change_stream):
+            self.change_stream = self.change_stream()
+        while True:
+            try:
+                if self.change_stream:
+                    self.watch()
+                else:
+                    self.poll()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_NOT_SUPPORTED:
+                    logger.warning("Change streams need a replica set, the seats are polled every %s seconds", self.poll_interval)
+                    self.change_stream = False
+                else:
+                    logger.exception("The seat feed failed, retrying")
+                    time.sleep(self.poll_interval)
+            except Exception:
+                #The thread must keep running, the change stream resumes after the last change it sent
+                logger.exception("The seat feed failed, retrying")
+                time.sleep(self.poll_interval)
+
+    def watch(self):
+        '''
+        Follows the changes of the seats of all the flights. Changes of flights without subscribers are dropped
+        '''
+        pipeline = [{"$match": {"$or": [
+            {"operationType": "delete"},
+            {"updateDescription.updatedFields.economyAvailableTickets": {"$exists": True}},
+            {"updateDescription.updatedFields.businessAvailableTickets": {"$exists": True}},
+        ]}}]
+        while True:
+            with self.flights.watch(pipeline, resume_after=self.resume_token) as stream:
+                for change in stream:
+                    self.resume_token = stream.resume_token
+                    flight_id = str(change["documentKey"]["_id"])
+                    if change["operationType"] == "delete":
+                        self.publish(flight_id, None)
+                    else:
+                        updated = change["updateDescription"]["updatedFields"]
+                        self.publish(flight_id, {field: updated[field] for field in SEAT_FIELDS if field in updated})
+
+    def poll(self):
+        '''
+        Reads the seats of the subscribed flights and sends those that changed since the last read
+        '''
+        last = {}
+        while not self.change_stream:
+            with self.lock:
+                flight_ids = list(self.subscribers)
+            if flight_ids:
+                found = {}
+                for flight in self.flights.find({"_id": {"$in": [ObjectId(id) for id in flight_ids]}}, SEAT_FIELDS):
+                    found[str(flight.pop("_id"))] = flight
+                for flight_id in flight_ids:
+                    seats = found.get(flight_id)
+                    #A flight that was just subscribed is sent too, in case it changed after the subscriber read it
+                    if flight_id not in last or seats != last[flight_id]:
+                        self.publish(flight_id, seats)
+                    last[flight_id] = seats
+            last = {flight_id: seats for flight_id, seats in last.items() if flight_id in flight_ids}
+            time.sleep(self.poll_interval)
@@ -0,0 +1,100 @@
+from flask.sessions import SessionInterface, SecureCookieSession
+from itsdangerous import BadSignature, Signer
+import json, secrets, time
+
+
+class ServerSideSession(SecureCookieSession):
+    '''
+    Session whose data is kept on the server. The cookie only has its signed id
+    '''
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.old_sid = None
+
+    def regenerate(self):
+        '''
+        Gives the session a new id, for example at login, so an id known before can't be used
+        '''
+        self.old_sid = self.old_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self["_created"] = time.time()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    '''
+    Keeps the sessions in a store of cache.py (in the process or in Redis), under the id that is signed in the cookie.
+    The store should expire entries after permanent_session_lifetime.
+    All the sessions of a user can be revoked with revoke_user()
+    '''
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_signer(self, app):
+        return Signer(app.secret_key, salt="session")
+
+    def revoke_user(self, username):
+        '''
+        Ends every session of the user that was created until now
+        '''
+        self.store.set("revoked:" + username, json.dumps(time.time()))
+
+    def is_revoked(self, data):
+        if not "username" in data:
+            return False
+        revoked = self.store.get("revoked:" + data["username"])
+        return revoked != None and data.get("_created", 0) <= json.loads(revoked)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self.get_signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.store.get("session:" + sid)
+                if data != None:
+                    data = json.loads(data)
+                    if not self.is_revoked(data):
+                        return ServerSideSession(data, sid)
+                    self.store.delete("session:" + sid)
+        session = ServerSideSession(sid=secrets.token_urlsafe(32))
+        session["_created"] = time.time()
+        #A new session is only stored once something else is put in it
+        session.modified = False
+        return session
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+        if session.old_sid != None:
+            self.store.delete("session:" + session.old_sid)
+
+        #The session was emptied (for example at logout) or only has its creation time
+        if set(session) <= {"_created"}:
+            if session.modified:
+                self.store.delete("session:" + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        self.store.set("session:" + session.sid, json.dumps(dict(session)))
+        response.set_cookie(
+            name,
+            self.get_signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
@@ -0,0 +1,85 @@
+'''
+The tests run the Flask app of app.py in the same process with mongomock as the database, so they need no MongoDB:
+    pip install pytest mongomock
+    python -m pytest tests
+'''
+from datetime import datetime
+import os, sys
+
+import mongomock, mongomock.collection, pymongo
+import pytest
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FLASK_DIR)
+#The cheapest cost of the password hashes, so logins are fast
+os.environ.setdefault("PASSWORD_HASH_COST", "8")
+pymongo.MongoClient = mongomock.MongoClient
+
+#pymongo 4.9 added 'sort' to the updates of bulk_write, which mongomock doesn't know yet
+add_update = mongomock.collection.BulkOperationBuilder.add_update
+mongomock.collection.BulkOperationBuilder.add_update = lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+
+import app as service
+
+#The collections emptied before every test. The versions are kept, so they never go back
+COLLECTIONS = ["Users", "Flights", "Bookings", "UserDeletions"]
+PASSENGER = {"firstName": "Giorgos", "lastName": "Papadopoulos", "email": "user@example.com", "passportNo": "1234", "birthDate": "1990-1-1"}
+
+
+@pytest.fixture(scope="session")
+def app():
+    flask_app = service.create_app()
+    flask_app.testing = True
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    for collection in COLLECTIONS:
+        service.db[collection].delete_many({})
+    service.flights_changed()
+    service.route_index.invalidate()
+    #Every test logs in many times from the same address
+    service.limiter.limits = {}
+    return service.db
+
+
+def login(app, email, password, type):
+    service.users.insert_one({"email": email, "password": password, "username": email.split("@")[0], "type": type})
+    client = app.test_client()
+    response = client.post("/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return client
+
+
+@pytest.fixture
+def user(app):
+    return login(app, PASSENGER["email"], "secret", "User")
+
+
+@pytest.fixture
+def admin(app):
+    return login(app, "admin@example.com", "admin", "Admin")
+
+
+@pytest.fixture
+def flight(database):
+    '''
+    A flight with 2 economy and 1 business seats left
+    '''
+    flight = {
+        "departAirport": "ATH",
+        "destAirport": "BCN",
+        "flightDate": datetime(2030, 6, 30),
+        "economyTicketCost": 100.0,
+        "businessTicketCost": 300.0,
+        "economyAvailableTickets": 2,
+        "businessAvailableTickets": 1,
+    }
+    database["Flights"].insert_one(flight)
+    return flight
+
+
+def seats(flight):
+    found = service.flights.find_one({"_id": flight["_id"]})
+    return found["economyAvailableTickets"], found["businessAvailableTickets"]
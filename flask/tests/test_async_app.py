@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+
+from conftest import PASSENGER, seats
+import app as service
+import async_app
+
+
+class AsyncCollection:
+    '''
+    Stand-in for a collection of the async driver over the collection of mongomock. mongomock can't run the $lookup
+    of the manifest, so an aggregation keeps its pipeline and returns the given documents
+    '''
+
+    def __init__(self, collection, results=None):
+        self.collection = collection
+        self.results = results if results != None else []
+        self.pipelines = []
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    async def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return AsyncCursor(self.results)
+
+
+class AsyncCursor:
+    def __init__(self, documents):
+        self.documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+@pytest.fixture
+def quart_app(app, monkeypatch):
+    '''
+    The Quart app of the async mode, with the Flask app of the tests and async stand-ins of the collections
+    '''
+    monkeypatch.setattr(service, "create_app", lambda: app)
+    monkeypatch.setattr(async_app, "users", AsyncCollection(service.users))
+    monkeypatch.setattr(async_app, "flights", AsyncCollection(service.flights))
+    monkeypatch.setattr(async_app, "bookings", AsyncCollection(service.bookings))
+    return async_app.create_app().app
+
+
+def run(quart_app, email, password, type, *requests):
+    '''
+    Logs in through the async login route and sends the requests, a method and the arguments of the test client each.
+    Returns the responses, with their bodies
+    '''
+    service.users.insert_one({"email": email, "password": password, "username": email.split("@")[0], "type": type})
+
+    async def send():
+        client = quart_app.test_client()
+        response = await client.post("/login", json={"email": email, "password": password})
+        assert response.status_code == 200, await response.get_data(as_text=True)
+        responses = []
+        for method, *args in requests:
+            response = await getattr(client, method)(*args[:1], **(args[1] if len(args) > 1 else {}))
+            responses.append((response.status_code, await response.get_data(as_text=True)))
+        return responses
+    return asyncio.run(send())
+
+
+def manifest(flight, passengers):
+    '''
+    The manifest that the aggregation of flight_manifest_pipeline() returns for the flight
+    '''
+    details = {field: flight[field] for field in ["departAirport", "destAirport", "economyTicketCost", "businessTicketCost"]}
+    return {
+        "flight": dict(details, _id=str(flight["_id"])),
+        "classes": {"economy": {"sold": len(passengers), "revenue": 100.0 * len(passengers)}, "business": {"sold": 0, "revenue": 0}},
+        "passengers": [{"_id": _id, "name": "Giorgos", "lastName": "Papadopoulos", "ticketType": "economy"} for _id in passengers],
+    }
+
+
+def test_async_flight_details_hide_the_seat_releases(quart_app, flight):
+    service.flights.update_one({"_id": flight["_id"]}, {"$set": {"seatReleases": ["job"]}})
+    async_app.flights.results = [manifest(flight, [1])]
+    [(status, body)] = run(quart_app, PASSENGER["email"], "secret", "User", ("get", "/flights/" + str(flight["_id"])))
+    assert status == 200
+    assert "seatReleases" not in body
+    [(status, body)] = run(quart_app, "admin@example.com", "admin", "Admin", ("get", "/flights/" + str(flight["_id"])))
+    assert status == 200
+    assert "seatReleases" not in body
+    #The admins get the same aggregation as in the sync mode, with the revenue computed in the database
+    assert async_app.flights.pipelines == [service.flight_manifest_pipeline(flight["_id"])]
+
+
+def test_async_manifest_has_the_shape_of_the_sync_manifest(quart_app, flight):
+    async_app.flights.results = [manifest(flight, [1, 2])]
+    [(status, body)] = run(quart_app, "admin@example.com", "admin", "Admin", ("get", "/flights/" + str(flight["_id"]) + "/manifest?limit=2"))
+    assert status == 200
+    expected = service.manifest_page(manifest(flight, [1, 2]), 2)
+    assert service.json.loads(body) == service.json.loads(service.json.dumps(expected))
+    assert async_app.flights.pipelines == [service.flight_manifest_pipeline(flight["_id"], 2, None)]
+
+
+def test_async_booking_takes_a_seat(quart_app, flight):
+    [(status, body)] = run(
+        quart_app, PASSENGER["email"], "secret", "User",
+        ("post", "/bookings/new/" + str(flight["_id"]), {"json": dict(PASSENGER, ticketType="business")}),
+    )
+    assert body == "You successfully booked the ticket!"
+    assert seats(flight) == (2, 0)
+    assert service.bookings.find_one({"flightID": flight["_id"]})["destAirport"] == "BCN"
+
+
+def test_only_the_flight_import_takes_large_bodies(quart_app, flight, monkeypatch):
+    quart_app.config["MAX_CONTENT_LENGTH"] = 100
+    monkeypatch.setattr(async_app, "IMPORT_MAX_SIZE", 1000)
+    monkeypatch.setattr(service, "import_flights_stream", lambda stream, format: {"size": len(stream.read())})
+    body = b"x" * 500
+    #The booking route can't read a body above the limit of the app
+    [(status, message)] = run(quart_app, PASSENGER["email"], "secret", "User", ("post", "/bookings/new/" + str(flight["_id"]), {"data": body}))
+    assert (status, message) == (400, "bad json content")
+    assert seats(flight) == (2, 1)
+    [(status, report), (too_large, _)] = run(
+        quart_app, "admin@example.com", "admin", "Admin",
+        ("post", "/flights/import", {"data": body}),
+        ("post", "/flights/import", {"data": body * 3}),
+    )
+    assert status == 200
+    assert service.json.loads(report) == {"size": 500}
+    assert too_large == 413
@@ -0,0 +1,32 @@
+from conftest import PASSENGER, seats
+import app as service
+
+
+def book(client, flight, ticket_type):
+    return client.post("/bookings/new/" + str(flight["_id"]), json=dict(PASSENGER, ticketType=ticket_type))
+
+
+def test_booking_takes_a_seat(user, flight):
+    response = book(user, flight, "economy")
+    assert response.get_data(as_text=True) == "You successfully booked the ticket!"
+    assert seats(flight) == (1, 1)
+    booking = service.bookings.find_one({"flightID": flight["_id"]})
+    assert booking["ticketType"] == "economy"
+    assert booking["destAirport"] == "BCN"
+
+
+def test_booking_is_refused_when_no_seats_are_left(user, flight):
+    assert book(user, flight, "business").status_code == 200
+    response = book(user, flight, "business")
+    assert response.get_data(as_text=True) == "Not Available Tickets left!"
+    assert seats(flight) == (2, 0)
+    assert service.bookings.count_documents({"flightID": flight["_id"]}) == 1
+
+
+def test_cancelling_a_booking_gives_the_seat_back(user, flight):
+    book(user, flight, "business")
+    booking = service.bookings.find_one({"flightID": flight["_id"]})
+    response = user.delete("/bookings/" + str(booking["_id"]))
+    assert response.status_code == 200
+    assert seats(flight) == (2, 1)
+    assert service.bookings.count_documents({}) == 0
@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+import pytest
+
+from conftest import PASSENGER, seats
+from deletions import UserDeletions
+import app as service
+
+
+@pytest.fixture
+def deletions(database):
+    '''
+    Deletions of their own jobs collection, run by the test instead of a thread
+    '''
+    database["TestDeletions"].delete_many({})
+    return UserDeletions(service.users, service.bookings, service.flights, database["TestDeletions"], batch_size=2)
+
+
+@pytest.fixture
+def booked(user, flight):
+    '''
+    The user has 2 economy and 1 business bookings on the flight, which has no seats left
+    '''
+    for ticket_type in ["economy", "economy", "business"]:
+        user.post("/bookings/new/" + str(flight["_id"]), json=dict(PASSENGER, ticketType=ticket_type))
+    assert seats(flight) == (0, 0)
+    return service.users.find_one({"email": PASSENGER["email"]})
+
+
+def test_batch_applied_twice_releases_the_seats_once(deletions, booked, flight):
+    batch = deletions.next_batch(PASSENGER["email"])
+    deletions.apply(batch)
+    deletions.apply(batch)
+    #The batch has the first two bookings, both of economy
+    assert seats(flight) == (2, 0)
+    assert service.bookings.count_documents({"email": PASSENGER["email"]}) == 1
+
+
+def test_interrupted_deletion_is_finished_without_releasing_seats_twice(deletions, booked, flight, monkeypatch):
+    job = deletions.request(booked)
+    apply = deletions.apply
+
+    def crash_after_apply(batch):
+        #The worker stops after the batch was applied but before the job knows it is done
+        apply(batch)
+        raise RuntimeError("The worker stopped")
+
+    monkeypatch.setattr(deletions, "apply", crash_after_apply)
+    with pytest.raises(RuntimeError):
+        deletions.process(deletions.claim())
+    monkeypatch.undo()
+    assert deletions.claim() == None
+
+    #Another worker takes the job when the lease ends and applies the same batch again
+    deletions.jobs.update_one({"_id": job["_id"]}, {"$set": {"leaseUntil": datetime.now(timezone.utc)}})
+    deletions.process(deletions.claim())
+
+    assert seats(flight) == (2, 1)
+    assert service.bookings.count_documents({}) == 0
+    assert service.users.count_documents({"email": PASSENGER["email"]}) == 0
+    assert "seatReleases" not in service.flights.find_one({"_id": flight["_id"]})
+    status = deletions.status(job["_id"])
+    assert status["status"] == "done"
+    assert status["bookingsDeleted"] == 3
+    assert status["seatsReleased"] == 3
+
+
+def test_deleting_user_cannot_log_in(app, user):
+    response = user.delete("/user/delete")
+    assert response.status_code == 202
+    assert user.get(response.headers["Location"]).get_json()["status"] in ("running", "done")
+    response = app.test_client().post("/login", json={"email": PASSENGER["email"], "password": "secret"})
+    assert response.status_code == 401
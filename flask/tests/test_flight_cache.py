@@ -0,0 +1,103 @@
+from cache import RedisCache
+import app as service
+
+NEW_FLIGHT = {
+    "departAirport": "ATH",
+    "destAirport": "BCN",
+    "flightDate": "2030-7-1",
+    "economyTicketCost": 90,
+    "businessTicketCost": 250,
+    "economyAvailableTickets": 10,
+    "businessAvailableTickets": 2,
+}
+
+
+def search(client, **headers):
+    return client.get("/flights?departAirport=ATH&destAirport=BCN", headers=headers)
+
+
+def test_search_is_answered_from_the_cache(user, flight):
+    first = search(user).get_json()["flights"]
+    #A change made behind the back of the service isn't seen until the cache is invalidated
+    service.flights.update_one({"_id": flight["_id"]}, {"$set": {"destAirport": "LHR"}})
+    assert search(user).get_json()["flights"] == first
+    service.flights_changed()
+    assert search(user).get_json()["flights"] == []
+
+
+def test_new_flight_invalidates_the_search(user, admin, flight):
+    assert len(search(user).get_json()["flights"]) == 1
+    assert admin.post("/flights/new", json=NEW_FLIGHT).status_code == 200
+    assert len(search(user).get_json()["flights"]) == 2
+
+
+def test_updated_and_deleted_flights_invalidate_the_search(user, admin, flight):
+    search(user)
+    response = admin.put("/flights/" + str(flight["_id"]), json={"economyTicketCost": 120, "businessTicketCost": 320, "destAirport": "LHR"})
+    assert response.status_code == 200
+    assert search(user).get_json()["flights"] == []
+    assert admin.delete("/flights/" + str(flight["_id"])).status_code == 200
+    assert user.get("/flights").get_json()["flights"] == []
+
+
+class RedisStandIn:
+    '''
+    Local stand-in for the Redis client of RedisCache, with the few commands it uses. It counts the calls,
+    as every one would be a round trip to Redis
+    '''
+
+    def __init__(self):
+        self.values = {}
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.calls += 1
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def delete(self, key):
+        self.calls += 1
+        self.values.pop(key, None)
+
+    def incr(self, key):
+        self.calls += 1
+        self.values[key] = str(int(self.values.get(key, 0)) + 1).encode()
+        return int(self.values[key])
+
+
+def test_redis_cache_is_shared_and_cleared_for_every_process():
+    redis = RedisStandIn()
+    first, second = RedisCache(redis, generation_ttl=0), RedisCache(redis, generation_ttl=0)
+    first.set(("ATH", "BCN"), "page")
+    assert second.get(("ATH", "BCN")) == "page"
+    second.delete(("ATH", "BCN"))
+    assert first.get(("ATH", "BCN")) == None
+    first.set(("ATH", "BCN"), "page")
+    second.clear()
+    assert first.get(("ATH", "BCN")) == None
+
+
+def test_redis_cache_reads_the_generation_once_per_ttl():
+    redis = RedisStandIn()
+    cache = RedisCache(redis, generation_ttl=60)
+    cache.get("key")
+    calls = redis.calls
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    assert redis.calls == calls + 2
+    #The process that clears the cache uses the new generation at once
+    cache.clear()
+    assert cache.get("key") == None
+
+
+def test_search_is_answered_from_a_shared_cache(user, flight, monkeypatch):
+    redis = RedisStandIn()
+    monkeypatch.setattr(service, "flight_cache", RedisCache(redis, "flights"))
+    first = search(user).get_json()["flights"]
+    service.flights.update_one({"_id": flight["_id"]}, {"$set": {"destAirport": "LHR"}})
+    assert search(user).get_json()["flights"] == first
+    service.flights_changed()
+    assert search(user).get_json()["flights"] == []
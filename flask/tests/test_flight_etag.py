@@ -0,0 +1,15 @@
+from test_flight_cache import NEW_FLIGHT, search
+import app as service
+
+
+def test_version_changes_the_etag_after_a_write(user, admin, flight):
+    response = search(user)
+    etag = response.headers["ETag"]
+    assert search(user, **{"If-None-Match": etag}).status_code == 304
+
+    version = service.flight_version.get()
+    admin.post("/flights/new", json=NEW_FLIGHT)
+    assert service.flight_version.get() > version
+    response = search(user, **{"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
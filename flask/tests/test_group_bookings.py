@@ -0,0 +1,35 @@
+import pytest
+
+from conftest import PASSENGER, seats
+import app as service
+
+
+def test_group_booking_takes_the_seats_of_every_passenger(user, flight):
+    passengers = [dict(PASSENGER, ticketType="economy"), dict(PASSENGER, ticketType="business")]
+    response = user.post("/bookings/group/" + str(flight["_id"]), json={"passengers": passengers})
+    assert len(response.get_json()["bookings"]) == 2
+    assert seats(flight) == (1, 0)
+
+
+def test_group_booking_takes_no_seat_unless_all_fit(user, flight):
+    passengers = [dict(PASSENGER, ticketType="economy"), dict(PASSENGER, ticketType="business"), dict(PASSENGER, ticketType="business")]
+    response = user.post("/bookings/group/" + str(flight["_id"]), json={"passengers": passengers})
+    assert response.get_data(as_text=True) == "Not enough Available Tickets left!"
+    assert seats(flight) == (2, 1)
+    assert service.bookings.count_documents({}) == 0
+
+
+def test_group_booking_is_rolled_back_when_the_bookings_fail(flight, monkeypatch):
+    insert_many = service.bookings.insert_many
+
+    def fail_after_first(documents, **kwargs):
+        #The first booking is written before the insert fails
+        insert_many(documents[:1])
+        raise RuntimeError("The insert failed")
+
+    monkeypatch.setattr(service.bookings, "insert_many", fail_after_first)
+    passengers = [dict(PASSENGER, ticketType="economy"), dict(PASSENGER, ticketType="economy")]
+    with pytest.raises(RuntimeError):
+        service.book_group(flight["_id"], passengers, {"economy": 2})
+    assert seats(flight) == (2, 1)
+    assert service.bookings.count_documents({}) == 0